@@ -0,0 +1,22 @@
+# -*- coding: utf-8 -*-
+
+import glob
+import os
+
+from pytest_benchmark.utils import get_machine_id
+
+
+def pytest_configure(config):
+    """Compare with the last results saved on this machine, if there are any.
+
+    Otherwise, the first run only saves its results for the next ones.
+    """
+    if not config.getoption("benchmark_compare"):
+        return
+
+    storage = config.getoption("benchmark_storage")
+    if storage.startswith("file://"):
+        storage = storage[len("file://") :]
+    if not glob.glob(os.path.join(storage, get_machine_id(), "*.json")):
+        config.option.benchmark_compare = False
+        config.option.benchmark_compare_fail = None
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""Benchmarks of the common workloads, run with `tox -e bench`.
+
+They need pytest-benchmark, and are not collected by a plain `pytest`.
+"""
+
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import expandvars
+
+ENVIRON = {"VAR{0}".format(i): "value{0}".format(i) for i in range(100)}
+ENVIRON.update(REF="VAR1", OFFSET="3", EMPTY="")
+
+PLAIN = "lorem ipsum dolor sit amet, consectetur adipiscing elit\n" * 2000
+DENSE = " ".join("$VAR{0} ${{VAR{0}}}".format(i % 100) for i in range(2000))
+NESTED = "${EMPTY:-" * 500 + "default" + "}" * 500
+SUBSTRINGS = " ".join(
+    "${{VAR{0}:2:3}} ${{VAR{0}:$OFFSET}}".format(i) for i in range(100)
+)
+INDIRECT = "${!REF} " * 1000
+CONFIG = "\n".join(
+    "key{0} = ${{VAR{1}:-default}} $VAR{1}:\\$HOME".format(i, i % 100)
+    for i in range(20000)
+)
+
+WORKLOADS = {
+    "plain": PLAIN,
+    "dense": DENSE,
+    "nested": NESTED,
+    "substrings": SUBSTRINGS,
+    "indirect": INDIRECT,
+}
+
+
+@pytest.fixture(params=["os.environ", "dict", "snapshot"])
+def environ(request, monkeypatch):
+    for name, value in ENVIRON.items():
+        monkeypatch.setenv(name, value)
+
+    if request.param == "os.environ":
+        return os.environ
+    elif request.param == "dict":
+        return dict(ENVIRON)
+    return expandvars.EnvironSnapshot()
+
+
+@pytest.mark.parametrize("workload", sorted(WORKLOADS))
+def test_expand(benchmark, workload, environ):
+    benchmark.group = "expand-" + workload
+    benchmark(expandvars.expand, WORKLOADS[workload], environ=environ)
+
+
+@pytest.mark.parametrize("workload", sorted(WORKLOADS))
+def test_compile(benchmark, workload):
+    benchmark.group = "compile"
+    benchmark(expandvars.compile, WORKLOADS[workload])
+
+
+def test_render(benchmark):
+    template = expandvars.compile(DENSE)
+    benchmark(template.render, environ=ENVIRON)
+
+
+def test_expand_short_cached(benchmark):
+    benchmark(expandvars.expand, "$VAR1:${VAR2:-default}/${VAR3}", environ=ENVIRON)
+
+
+def test_expand_file(benchmark, tmp_path):
+    path = tmp_path / "config.ini"
+    path.write_text(CONFIG)
+
+    def expand_file():
+        with open(path) as f:
+            return expandvars.expand(f, environ=ENVIRON)
+
+    benchmark.group = "file"
+    benchmark(expand_file)
+
+
+def test_expand_stream(benchmark, tmp_path):
+    path = tmp_path / "config.ini"
+    path.write_text(CONFIG)
+
+    def expand_stream():
+        with open(path) as f:
+            for _ in expandvars.expand_stream(f, environ=ENVIRON):
+                pass
+
+    benchmark.group = "file"
+    benchmark(expand_stream)
+
+
+# Short strings, parsed once and then found in the cache, like in a pool of
+# workers expanding the same settings over and over again.
+SETTINGS = [
+    "$VAR{0}:${{VAR{1}:-default}}/${{VAR{2}#value}}".format(i, i % 7, i % 13)
+    for i in range(100)
+]
+
+
+@pytest.mark.parametrize("threads", [1, 2, 4, 8])
+def test_expand_threads(benchmark, threads):
+    """The same work, split between threads.
+
+    Only meaningful on a machine with at least as many CPUs as threads. No
+    results have been recorded on a free-threaded build of Python yet.
+    """
+    rounds = 64 // threads
+
+    def work(_):
+        for _ in range(rounds):
+            for text in SETTINGS:
+                expandvars.expand(text, environ=ENVIRON)
+
+    benchmark.group = "threads"
+    benchmark.extra_info["gil"] = getattr(sys, "_is_gil_enabled", lambda: True)()
+    benchmark.extra_info["cpus"] = os.cpu_count()
+    with ThreadPoolExecutor(threads) as pool:
+        benchmark(lambda: list(pool.map(work, range(threads))))
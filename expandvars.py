@@ -1,7 +1,15 @@
 # -*- coding: utf-8 -*-
 
+import copy
+import heapq
 import os
+import re
+import sys
+import threading
+from collections import ChainMap, namedtuple
+from functools import partial, update_wrapper
 from io import TextIOWrapper
+from time import perf_counter
 
 __author__ = "Arijit Basu"
 __email__ = "sayanarijit@gmail.com"
@@ -11,198 +19,1984 @@ __version__ = "v1.1.2"
 __license__ = "MIT"
 __all__ = [
     "BadSubstitution",
+    "EnvironOverlay",
+    "EnvironSnapshot",
     "ExpandvarsException",
     "MissingClosingBrace",
     "MissingEscapedChar",
     "NegativeSubStringExpression",
+    "NestingTooDeep",
     "OperandExpected",
     "ParameterNullOrNotSet",
+    "References",
+    "Stats",
+    "Template",
+    "TemplateSet",
     "UnboundVariable",
+    "aexpand",
+    "cache_clear",
+    "cache_info",
+    "compile",
+    "compile_file",
     "expand",
+    "expand_files",
+    "expand_into",
+    "expand_many",
+    "expand_stream",
+    "expand_structure",
     "expandvars",
+    "iter_expand",
+    "main",
+    "referenced_vars",
+    "set_cache_maxsize",
 ]
 
 
 ESCAPE_CHAR = "\\"
 VAR_SYMBOL = "$"
 
+# Number of parsed strings kept around by expand(). See set_cache_maxsize().
+CACHE_MAXSIZE = 256
+
+# Longer strings are parsed on every call, so that the cache doesn't pin
+# arbitrarily large texts in memory.
+_CACHEABLE_LENGTH = 4096
+
+# Total size, in bytes, of the parsed files kept by compile_file() in its
+# cache_dir. The least recently used ones are deleted first.
+DISK_CACHE_SIZE = 64 * 1024 * 1024
+
+# Version of the format of the files cached by compile_file(). Changing it
+# invalidates them, so it must change whenever the parsed nodes do.
+_DISK_CACHE_FORMAT = 1
+
+# Number of characters read at once by expand_stream().
+CHUNK_SIZE = 64 * 1024
+
+# Longest text quoted in full in the messages of syntax errors. Longer texts
+# are cut around the error, so that huge inputs don't make huge messages.
+_CONTEXT_WIDTH = 80
+
+# Maximum number of nested expressions, e.g. ${A:-${B:-...}}, in a string.
+MAX_DEPTH = 1000
+
 
 class ExpandvarsException(Exception):
-    """The base exception for all the handleable exceptions."""
+    """The base exception for all the handleable exceptions.
+
+    When known, the location of the error is recorded in the position (from
+    0), line and column (from 1) attributes, and the name of the variable in
+    var. expand_structure() also records the keys leading to the string in
+    path.
+    """
+
+    position = line = column = var = path = None
+
+    def __reduce__(self):
+        # The subclasses build their message in __init__(), so unpickling must
+        # not call it again, e.g. when sent back from another process.
+        return _rebuild_exception, (type(self), self.args, self.__dict__)
+
+
+def _rebuild_exception(cls, args, state):
+    exc = cls.__new__(cls, *args)
+    # Initialize the builtin base, e.g. SyntaxError, with the final message.
+    super(ExpandvarsException, exc).__init__(*args)
+    exc.__dict__.update(state)
+    return exc
+
+
+def _syntax_error(cls, source, position, var=None, *args):
+    """Build the exception, quoting the source around the position."""
+    return _locate(cls(_context(source, position), *args), source, position, var)
+
+
+def _locate(exc, source, position, var=None):
+    """Record where in the source the exception occurred."""
+    newline = _NEWLINE_RE[str if isinstance(source, str) else bytes]
+    line, line_start = 1, 0
+    for match in newline.finditer(source, 0, position):
+        line, line_start = line + 1, match.end()
+
+    exc.position, exc.var = position, var
+    exc.line, exc.column = line, position - line_start + 1
+    return exc
+
+
+def _context(source, position):
+    """Quote the source, or the part of its line around position if too long."""
+    if len(source) <= _CONTEXT_WIDTH:
+        return _quote(source)
+
+    newline = _NEWLINE_RE[str if isinstance(source, str) else bytes]
+    start = max(0, position - _CONTEXT_WIDTH // 2)
+    for match in newline.finditer(source, start, position):
+        start = match.end()
+    end = min(len(source), start + _CONTEXT_WIDTH)
+    match = newline.search(source, position, end)
+    if match is not None:
+        end = match.start()
+
+    return "{0}{1}{2}".format(
+        "..." if start > 0 else "",
+        _quote(source[start:end]),
+        "..." if end < len(source) else "",
+    )
+
+
+def _quote(text):
+    """Decode bytes-like text from UTF-8, to be quoted in a message."""
+    if isinstance(text, str):
+        return text
+    return bytes(text).decode("utf-8", "backslashreplace")
+
+
+class MissingClosingBrace(ExpandvarsException, SyntaxError):
+    def __init__(self, param):
+        super().__init__("{0}: missing '}}'".format(param))
+
+
+class MissingEscapedChar(ExpandvarsException, SyntaxError):
+    def __init__(self, param):
+        super().__init__("{0}: missing escaped character".format(param))
+
+
+class OperandExpected(ExpandvarsException, SyntaxError):
+    def __init__(self, param, operand):
+        super().__init__(
+            "{0}: operand expected (error token is {1})".format(param, repr(operand))
+        )
+
+
+class NegativeSubStringExpression(ExpandvarsException, IndexError):
+    def __init__(self, param, expr):
+        super().__init__("{0}: {1}: substring expression < 0".format(param, expr))
+
+
+class BadSubstitution(ExpandvarsException, SyntaxError):
+    def __init__(self, param):
+        super().__init__("{0}: bad substitution".format(param))
+
+
+class NestingTooDeep(ExpandvarsException, RecursionError):
+    def __init__(self, param, limit):
+        super().__init__(
+            "{0}: expressions nested more than {1} levels deep".format(param, limit)
+        )
+
+
+class ParameterNullOrNotSet(ExpandvarsException, KeyError):
+    def __init__(self, param, msg=None):
+        if msg is None:
+            msg = "parameter null or not set"
+        super().__init__("{0}: {1}".format(param, msg))
+
+
+class UnboundVariable(ExpandvarsException, KeyError):
+    def __init__(self, param):
+        super().__init__("{0}: unbound variable".format(param))
+
+
+class InvalidIndirectExpansion(ExpandvarsException, KeyError):
+    def __init__(self, param):
+        super().__init__("{0}: invalid indirect expansion".format(param))
+
+
+class EnvironSnapshot(dict):
+    """A plain dict copy of an environment, to be passed as environ.
+
+    Reading os.environ encodes the name and decodes the value on every
+    lookup, which a plain dict avoids. The copy is taken once and reused
+    until refresh() is called. Assignments like ${VAR:=default} are written
+    to both the snapshot and the original environment.
+
+    Example usage: ::
+
+        from expandvars import EnvironSnapshot, expand
+
+        environ = EnvironSnapshot()
+
+        for line in lines:
+            print(expand(line, environ=environ))
+
+        # Pick up the changes made to os.environ since.
+        environ.refresh()
+    """
+
+    __slots__ = ("environ",)
+
+    def __init__(self, environ=os.environ):
+        super().__init__(environ)
+        self.environ = environ
+
+    def __setitem__(self, var, val):
+        self.environ[var] = val
+        super().__setitem__(var, val)
+
+    def refresh(self):
+        """Copy the original environment again, discarding the previous copy."""
+        self.clear()
+        self.update(self.environ)
+
+
+class EnvironOverlay(ChainMap):
+    """A layer over an environment, keeping the assignments to itself.
+
+    Variables are read from the layer first, then from the environment,
+    which is never written to. Assignments like ${VAR:=default} only go to
+    the layer, and are recorded in assignments, so that expanding does not
+    call putenv() nor change the environment seen by other threads. Use one
+    overlay per render or batch, and discard it, or read the assignments,
+    afterwards.
+
+    Example usage: ::
+
+        from expandvars import EnvironOverlay, expand
+
+        environ = EnvironOverlay()
+
+        print(expand("${PORT:=8080}", environ=environ))
+        # 8080
+
+        print(environ.assignments)
+        # {'PORT': '8080'}
+    """
+
+    def __init__(self, environ=os.environ):
+        super().__init__({}, environ)
+
+    @property
+    def assignments(self):
+        """The variables assigned through the overlay, and their values."""
+        return self.maps[0]
+
+    def get(self, var, default=None):
+        # Faster than ChainMap.get(), which looks up the variable twice.
+        assignments = self.maps[0]
+        if var in assignments:
+            return assignments[var]
+        return self.maps[1].get(var, default)
+
+
+def getenv(var, indirect, environ, var_symbol=VAR_SYMBOL):
+    """Get value from environment variable.
+
+    When indirect is True, it will use the value of the resolved variable as
+    the name of the final variable.
+    """
+
+    if var == var_symbol:
+        return str(os.getpid())
+
+    val = environ.get(var)
+
+    if indirect:
+        if val is None:
+            raise InvalidIndirectExpansion(var)
+        else:
+            val = getenv(
+                val,
+                indirect=False,
+                environ=environ,
+                var_symbol=var_symbol,
+            )
+
+    return val
+
+
+def expand(
+    vars_,
+    nounset=False,
+    environ=os.environ,
+    var_symbol=VAR_SYMBOL,
+    surrounded_vars_only=False,
+    escape_char=ESCAPE_CHAR,
+    stats=None,
+    on_lookup=None,
+):
+    """Expand variables Unix style.
+
+    Bytes-like vars_, i.e. bytes, bytearray, memoryview or mmap.mmap, are
+    expanded as bytes, without being decoded. environ must then have bytes
+    names and values, like os.environb.
+
+    Params:
+        vars_ (str):  Variables to expand.
+        nounset (bool): If True, enables strict parsing (similar to set -u / set -o nounset in bash).
+        environ (Mapping): Elements to consider during variable expansion. Defaults to os.environ, or os.environb for bytes
+        var_symbol (str): Character used to identify a variable. Defaults to $
+        stats (Stats): If given, the counters to update. See Stats.
+        on_lookup (callable): If given, called as on_lookup(name, found, elapsed) after each variable lookup, elapsed being in seconds.
+
+    Returns:
+        str: Expanded values, or bytes. If vars_ is a str or bytes that
+            contains neither var_symbol nor escape_char, vars_ itself is
+            returned, without being copied.
+
+    Example usage: ::
+
+        from expandvars import expand
+
+        print(expand("%PATH:$HOME/bin:%{SOME_UNDEFINED_PATH:-/default/path}", environ={"PATH": "/example"}, var_symbol="%"))
+        # /example:$HOME/bin:/default/path
+
+        # Or
+        with open(somefile) as f:
+            print(expand(f))
+    """
+    if isinstance(vars_, TextIOWrapper):
+        # This is a file. Read it.
+        vars_ = vars_.read()
+
+    if _nothing_to_expand(vars_, var_symbol, escape_char):
+        if stats is not None:
+            stats.expansions += 1
+            stats.chars += len(vars_)
+        return vars_ if isinstance(vars_, (str, bytes)) else bytes(vars_)
+
+    template = _get_template(vars_, var_symbol, surrounded_vars_only, escape_char)
+    return template.render(
+        environ=environ, nounset=nounset, stats=stats, on_lookup=on_lookup
+    )
+
+
+def iter_expand(
+    vars_,
+    nounset=False,
+    environ=os.environ,
+    var_symbol=VAR_SYMBOL,
+    surrounded_vars_only=False,
+    escape_char=ESCAPE_CHAR,
+):
+    """Expand variables Unix style, piece by piece.
+
+    The expanded text is never joined into one string: each literal part and
+    each expanded variable is yielded as soon as it is ready, so that the
+    output can be sent elsewhere as it is produced. Files are expanded chunk
+    by chunk with expand_stream(), without being read at once.
+
+    Params:
+        vars_ (str): Variables to expand, or a text file.
+        nounset (bool): If True, enables strict parsing (similar to set -u / set -o nounset in bash).
+        environ (Mapping): Elements to consider during variable expansion. Defaults to os.environ, or os.environb for bytes
+        var_symbol (str): Character used to identify a variable. Defaults to $
+        surrounded_vars_only (bool): If True, only variables in braces are expanded.
+        escape_char (str): Character used to escape the var_symbol. Defaults to \\
+
+    Returns:
+        Iterator[str]: Non-empty pieces of the expanded text, or bytes.
+
+    Example usage: ::
+
+        from expandvars import iter_expand
+
+        print(list(iter_expand("$HOST:${PORT:-8080}", environ={"HOST": "localhost"})))
+        # ['localhost', ':', '8080']
+    """
+    if isinstance(vars_, TextIOWrapper):
+        # This is a file. Read it as it goes.
+        yield from expand_stream(
+            vars_,
+            nounset=nounset,
+            environ=environ,
+            var_symbol=var_symbol,
+            surrounded_vars_only=surrounded_vars_only,
+            escape_char=escape_char,
+        )
+        return
+
+    if _nothing_to_expand(vars_, var_symbol, escape_char):
+        if vars_:
+            yield vars_ if isinstance(vars_, (str, bytes)) else bytes(vars_)
+        return
+
+    template = _get_template(vars_, var_symbol, surrounded_vars_only, escape_char)
+    yield from template.iter_render(environ=environ, nounset=nounset)
+
+
+def expand_into(
+    vars_,
+    writer,
+    nounset=False,
+    environ=os.environ,
+    var_symbol=VAR_SYMBOL,
+    surrounded_vars_only=False,
+    escape_char=ESCAPE_CHAR,
+):
+    """Expand variables Unix style, writing the result as it is produced.
+
+    Like iter_expand(), but each piece is passed to writer.write(). If an
+    error is raised, what was expanded before it has already been written.
+
+    Params:
+        vars_ (str): Variables to expand, or a text file.
+        writer: Any object with a write() method, e.g. a file or a socket file.
+        nounset (bool): If True, enables strict parsing (similar to set -u / set -o nounset in bash).
+        environ (Mapping): Elements to consider during variable expansion. Defaults to os.environ, or os.environb for bytes
+        var_symbol (str): Character used to identify a variable. Defaults to $
+        surrounded_vars_only (bool): If True, only variables in braces are expanded.
+        escape_char (str): Character used to escape the var_symbol. Defaults to \\
+
+    Example usage: ::
+
+        import sys
+        from expandvars import expand_into
+
+        expand_into("$HOME/bin", sys.stdout)
+
+        # Or
+        with open(somefile) as f, sock.makefile("w") as out:
+            expand_into(f, out)
+    """
+    write = writer.write
+    for piece in iter_expand(
+        vars_,
+        nounset=nounset,
+        environ=environ,
+        var_symbol=var_symbol,
+        surrounded_vars_only=surrounded_vars_only,
+        escape_char=escape_char,
+    ):
+        write(piece)
+
+
+async def aexpand(
+    vars_,
+    environ,
+    nounset=False,
+    var_symbol=VAR_SYMBOL,
+    surrounded_vars_only=False,
+    escape_char=ESCAPE_CHAR,
+    concurrency=16,
+):
+    """Expand variables Unix style, reading them from an asynchronous source.
+
+    All the variables used are looked up concurrently before expanding them,
+    followed by a second round for the targets of indirect references like
+    ${!VAR}. Assignments like ${VAR:=default} are not written back to environ.
+
+    Params:
+        vars_ (str): Variables to expand.
+        environ: Elements to consider during variable expansion. Its get(name) method must return an awaitable resolving to the value, or None.
+        nounset (bool): If True, enables strict parsing (similar to set -u / set -o nounset in bash).
+        var_symbol (str): Character used to identify a variable. Defaults to $
+        surrounded_vars_only (bool): If True, only variables in braces are expanded.
+        escape_char (str): Character used to escape the var_symbol. Defaults to \\
+        concurrency (int): Maximum number of lookups running at the same time.
+
+    Returns:
+        str: Expanded values.
+
+    Example usage: ::
+
+        from expandvars import aexpand
+
+        class SecretStore:
+            async def get(self, name):
+                ...
+
+        print(await aexpand("postgres://$DB_USER:$DB_PASSWORD@db", SecretStore()))
+    """
+    import asyncio
+
+    if _nothing_to_expand(vars_, var_symbol, escape_char):
+        return vars_
+
+    template = _get_template(vars_, var_symbol, surrounded_vars_only, escape_char)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def get(var):
+        async with semaphore:
+            return var, await environ.get(var)
+
+    async def resolve(vars_):
+        return dict(await asyncio.gather(*(get(var) for var in vars_)))
+
+    names, indirect = _lookups(template._nodes, var_symbol, nounset=nounset)
+    values = await resolve(names)
+
+    targets = {values[var] for var in indirect}
+    targets.difference_update(values, (None, var_symbol))
+    if targets:
+        values.update(await resolve(targets))
+
+    resolved = {var: val for var, val in values.items() if val is not None}
+    return template.render(environ=resolved, nounset=nounset)
+
+
+def expandvars(vars_, nounset=False):
+    """Expand system variables Unix style.
+
+    Params:
+        vars_ (str): System variables to expand.
+        nounset (bool): If True, enables strict parsing (similar to set -u / set -o nounset in bash).
+
+    Returns:
+        str: Expanded values. If vars_ contains neither $ nor \\, vars_ itself
+            is returned, without being copied.
+
+    Example usage: ::
+
+        from expandvars import expandvars
+
+        print(expandvars("$PATH:$HOME/bin:${SOME_UNDEFINED_PATH:-/default/path}"))
+        # /bin:/sbin:/usr/bin:/usr/sbin:/home/you/bin:/default/path
+
+        # Or
+        with open(somefile) as f:
+            print(expandvars(f))
+    """
+    return expand(vars_, nounset=nounset)
+
+
+def expand_many(
+    vars_list,
+    nounset=False,
+    environ=os.environ,
+    var_symbol=VAR_SYMBOL,
+    surrounded_vars_only=False,
+    escape_char=ESCAPE_CHAR,
+    lazy=False,
+):
+    """Expand many strings in one go.
+
+    Each distinct string is parsed only once, and each variable is read from
+    environ only once, so the whole batch sees a consistent snapshot of it.
+    Assignments like ${VAR:=default} are still written to environ, and are
+    visible to the strings that follow.
+
+    Params:
+        vars_list (Iterable[str]): Strings to expand.
+        nounset (bool): If True, enables strict parsing (similar to set -u / set -o nounset in bash).
+        environ (Mapping): Elements to consider during variable expansion. Defaults to os.environ
+        var_symbol (str): Character used to identify a variable. Defaults to $
+        surrounded_vars_only (bool): If True, only variables in braces are expanded.
+        escape_char (str): Character used to escape the var_symbol. Defaults to \\
+        lazy (bool): If True, returns an iterator that expands strings as they are consumed.
+
+    Returns:
+        list: Expanded strings, in the same order. An iterator if lazy is True.
+
+    Example usage: ::
+
+        from expandvars import expand_many
+
+        print(expand_many(["$HOME", "${PORT:-8080}", "$HOME"]))
+        # ['/home/you', '8080', '/home/you']
+    """
+    expanded = _expand_many(
+        vars_list,
+        nounset=nounset,
+        environ=environ,
+        var_symbol=var_symbol,
+        surrounded_vars_only=surrounded_vars_only,
+        escape_char=escape_char,
+    )
+    return expanded if lazy else list(expanded)
+
+
+def _expand_many(
+    vars_list, nounset, environ, var_symbol, surrounded_vars_only, escape_char
+):
+    environ = _MemoizedEnviron(environ)
+    templates = {}
+
+    for vars_ in vars_list:
+        if _nothing_to_expand(vars_, var_symbol, escape_char):
+            yield vars_
+            continue
+
+        template = templates.get(vars_)
+        if template is None:
+            template = templates[vars_] = compile(
+                vars_,
+                var_symbol=var_symbol,
+                surrounded_vars_only=surrounded_vars_only,
+                escape_char=escape_char,
+            )
+            environ.prefetch(template._nodes, var_symbol, nounset=nounset)
+        yield template.render(environ=environ, nounset=nounset)
+
+
+def expand_structure(
+    obj,
+    nounset=False,
+    environ=os.environ,
+    var_symbol=VAR_SYMBOL,
+    surrounded_vars_only=False,
+    escape_char=ESCAPE_CHAR,
+    keys=False,
+):
+    """Expand the strings in nested dicts, lists and tuples, e.g. a loaded config.
+
+    Like in expand_many(), each distinct string is parsed only once, and each
+    variable is read from environ only once. The containers where nothing was
+    expanded are returned as is, without being copied, and the others are
+    copied with their type. Values of any other type are left as they are.
+
+    If a string fails to expand, the keys and indexes leading to it are
+    recorded in the path attribute of the exception.
+
+    Params:
+        obj: The structure to expand.
+        nounset (bool): If True, enables strict parsing (similar to set -u / set -o nounset in bash).
+        environ (Mapping): Elements to consider during variable expansion. Defaults to os.environ
+        var_symbol (str): Character used to identify a variable. Defaults to $
+        surrounded_vars_only (bool): If True, only variables in braces are expanded.
+        escape_char (str): Character used to escape the var_symbol. Defaults to \\
+        keys (bool): If True, the keys of the dicts are expanded too.
+
+    Returns:
+        The expanded structure.
+
+    Example usage: ::
+
+        import json
+        from expandvars import expand_structure
+
+        with open("config.json") as f:
+            config = expand_structure(json.load(f))
+
+        print(expand_structure({"db": {"hosts": ["$HOST:${PORT:-5432}"]}}, environ={"HOST": "db"}))
+        # {'db': {'hosts': ['db:5432']}}
+    """
+    environ = _MemoizedEnviron(environ)
+    templates = {}
+
+    def expand_string(vars_, path):
+        if _nothing_to_expand(vars_, var_symbol, escape_char):
+            return vars_
+
+        try:
+            template = templates.get(vars_)
+            if template is None:
+                template = templates[vars_] = compile(
+                    vars_,
+                    var_symbol=var_symbol,
+                    surrounded_vars_only=surrounded_vars_only,
+                    escape_char=escape_char,
+                )
+                environ.prefetch(template._nodes, var_symbol, nounset=nounset)
+            result = template.render(environ=environ, nounset=nounset)
+        except ExpandvarsException as e:
+            e.path = tuple(path)
+            raise
+
+        return vars_ if result == vars_ else result
+
+    return _expand_structure(obj, [], expand_string, keys)
+
+
+def _expand_structure(obj, path, expand_string, keys):
+    if isinstance(obj, str):
+        return expand_string(obj, path)
+
+    if isinstance(obj, dict):
+        items, changed = [], False
+        for key, value in obj.items():
+            path.append(key)
+            new_key = expand_string(key, path) if keys and isinstance(key, str) else key
+            new_value = _expand_structure(value, path, expand_string, keys)
+            path.pop()
+            changed = changed or new_key is not key or new_value is not value
+            items.append((new_key, new_value))
+    elif isinstance(obj, (list, tuple)):
+        items, changed = [], False
+        for index, value in enumerate(obj):
+            path.append(index)
+            new_value = _expand_structure(value, path, expand_string, keys)
+            path.pop()
+            changed = changed or new_value is not value
+            items.append(new_value)
+    else:
+        return obj
+
+    if not changed:
+        return obj
+    if hasattr(obj, "_make"):
+        # A namedtuple.
+        return obj._make(items)
+    if isinstance(obj, dict) and type(obj) is not dict:
+        # Subclasses like defaultdict may take other arguments, so keep them.
+        new = copy.copy(obj)
+        new.clear()
+        new.update(items)
+        return new
+    return type(obj)(items)
+
+
+class _MemoizedEnviron:
+    """Reads each variable from the wrapped environ at most once."""
+
+    __slots__ = ("environ", "_values")
+
+    def __init__(self, environ):
+        self.environ = environ
+        self._values = {}
+
+    def get(self, var, default=None):
+        try:
+            val = self._values[var]
+        except KeyError:
+            val = self._values[var] = self.environ.get(var)
+        return default if val is None else val
+
+    def __setitem__(self, var, val):
+        self.environ[var] = val
+        self._values[var] = val
+
+    def prefetch(self, nodes, var_symbol, nounset):
+        """Look up all the variables needed to expand the nodes in one go.
+
+        Only done when the wrapped environ has a get_many(names) method.
+        """
+        get_many = getattr(self.environ, "get_many", None)
+        if get_many is None:
+            return
+
+        names, indirect = _lookups(nodes, var_symbol, nounset=nounset)
+        self._get_many(get_many, names)
+
+        targets = {self._values[var] for var in indirect}
+        targets.discard(None)
+        targets.discard(var_symbol)
+        self._get_many(get_many, targets)
+
+    def _get_many(self, get_many, names):
+        names = [var for var in names if var not in self._values]
+        if names:
+            values = get_many(names)
+            for var in names:
+                self._values[var] = values.get(var)
+
+
+class _InstrumentedEnviron:
+    """Wraps environ to time the lookups and count them in stats."""
+
+    __slots__ = ("environ", "stats", "on_lookup")
+
+    def __init__(self, environ, stats, on_lookup):
+        self.environ = environ
+        self.stats = stats
+        self.on_lookup = on_lookup
+
+    def get(self, var, default=None):
+        if var == "EXPANDVARS_RECOVER_NULL":
+            # Only read when about to be used instead of raising an error.
+            val = self.environ.get(var, default)
+            if val is not None:
+                self.stats.recovered_null += 1
+            return val
+
+        start = perf_counter()
+        val = self.environ.get(var, default)
+        elapsed = perf_counter() - start
+
+        self.stats.lookups += 1
+        if val is None:
+            self.stats.unset += 1
+        if self.on_lookup is not None:
+            self.on_lookup(var, val is not None, elapsed)
+        return val
+
+    def __setitem__(self, var, value):
+        self.stats.assignments += 1
+        self.environ[var] = value
+
+    def modify(self, node, val, modifier, nounset, environ):
+        if not val and node.modifier_type in (
+            ModifierType.GET_DEFAULT,
+            ModifierType.GET_OR_SET_DEFAULT,
+        ):
+            self.stats.defaults += 1
+        return _modify(node, val, modifier, nounset, environ)
+
+
+class _RecordingEnviron:
+    """Wraps environ to record the variables read, and the ones assigned."""
+
+    __slots__ = ("environ", "names", "assigned")
+
+    def __init__(self, environ):
+        self.environ = environ
+        self.names = set()
+        self.assigned = set()
+
+    def get(self, var, default=None):
+        self.names.add(var)
+        return self.environ.get(var, default)
+
+    def __setitem__(self, var, value):
+        if self.environ.get(var) != value:
+            self.assigned.add(var)
+        self.environ[var] = value
+
+
+class _BytesEnviron:
+    """Wraps an environ with bytes names and values, e.g. os.environb.
+
+    The names and values are decoded from latin-1, which maps each byte to a
+    character and back, so that the rendering works with text.
+    """
+
+    __slots__ = ("environ",)
+
+    def __init__(self, environ):
+        self.environ = environ
+
+    def get(self, var, default=None):
+        val = self.environ.get(var.encode("latin-1"))
+        return default if val is None else val.decode("latin-1")
+
+    def __setitem__(self, var, value):
+        self.environ[var.encode("latin-1")] = value.encode("latin-1")
+
+
+class _FsEncodedEnviron:
+    """Wraps an environ with text names and values, to use bytes ones instead.
+
+    Like os.environb does, they are converted with os.fsencode() and
+    os.fsdecode().
+    """
+
+    __slots__ = ("environ",)
+
+    def __init__(self, environ):
+        self.environ = environ
+
+    def get(self, var, default=None):
+        val = self.environ.get(os.fsdecode(var))
+        return default if val is None else os.fsencode(val)
+
+    def __setitem__(self, var, value):
+        self.environ[os.fsdecode(var)] = os.fsdecode(value)
+
+
+def _lookups(nodes, var_symbol, nounset):
+    """Find the variables that expanding the nodes may look up.
+
+    Returns:
+        tuple: The set of names, and the set of indirect references among them.
+    """
+    names, indirect = set(), set()
+    for node in _iter_vars(nodes):
+        if node.name == var_symbol:
+            continue
+        names.add(node.name)
+        if node.indirect:
+            indirect.add(node.name)
+        if node.modifier_type == ModifierType.STRICT:
+            nounset = True
+
+    if nounset:
+        names.add("EXPANDVARS_RECOVER_NULL")
+    return names, indirect
+
+
+def _get_template(vars_, var_symbol, surrounded_vars_only, escape_char):
+    # Mutable buffers, like bytearray, can't be cached.
+    if len(vars_) <= _CACHEABLE_LENGTH and isinstance(vars_, (str, bytes)):
+        return _compile_cached(vars_, var_symbol, surrounded_vars_only, escape_char)
+    return compile(
+        vars_,
+        var_symbol=var_symbol,
+        surrounded_vars_only=surrounded_vars_only,
+        escape_char=escape_char,
+    )
+
+
+def _nothing_to_expand(vars_, var_symbol, escape_char):
+    if isinstance(vars_, str):
+        return var_symbol not in vars_ and not (escape_char and escape_char in vars_)
+
+    special = _special_chars_re(
+        var_symbol.encode("latin-1"), escape_char and escape_char.encode("latin-1")
+    )
+    return special is None or special.search(vars_) is None
+
+
+def expand_files(
+    paths,
+    out_dir,
+    workers=None,
+    nounset=False,
+    environ=os.environ,
+    var_symbol=VAR_SYMBOL,
+    surrounded_vars_only=False,
+    escape_char=ESCAPE_CHAR,
+):
+    """Expand many files in parallel, using a pool of processes.
+
+    Each file is expanded into a file with the same name in out_dir, created
+    if needed, or in place if out_dir is None. It is written under a
+    temporary name first, and renamed once complete, so the output is never
+    left half written. The line endings are kept as they are.
+
+    The environ is copied once and sent to each process when it starts.
+    Assignments like ${VAR:=default} only apply to the file that makes them.
+
+    Params:
+        paths (Iterable[str]): Files to expand.
+        out_dir (str): Directory where to write the expanded files, or None to overwrite them.
+        workers (int): Number of processes to use. Defaults to the number of CPUs. With 1, the files are expanded in the current process.
+        nounset (bool): If True, enables strict parsing (similar to set -u / set -o nounset in bash).
+        environ (Mapping): Elements to consider during variable expansion. Defaults to os.environ
+        var_symbol (str): Character used to identify a variable. Defaults to $
+        surrounded_vars_only (bool): If True, only variables in braces are expanded.
+        escape_char (str): Character used to escape the var_symbol. Defaults to \\
+
+    Returns:
+        dict: The exception raised for each path that couldn't be expanded.
+            The other files are expanded regardless.
+
+    Example usage: ::
+
+        from expandvars import expand_files
+
+        errors = expand_files(["app.conf", "db.conf"], out_dir="/etc/myapp")
+        for path, error in errors.items():
+            print(path, error)
+    """
+    jobs, outputs = [], set()
+    for path in paths:
+        if out_dir is None:
+            out_path = path
+        else:
+            out_path = os.path.join(out_dir, os.path.basename(path))
+        if out_path in outputs:
+            raise ValueError("{0}: duplicate output file {1}".format(path, out_path))
+        outputs.add(out_path)
+        jobs.append((path, out_path))
+
+    if out_dir is not None:
+        os.makedirs(out_dir, exist_ok=True)
+
+    options = (dict(environ), nounset, var_symbol, surrounded_vars_only, escape_char)
+    workers = min(workers or os.cpu_count() or 1, len(jobs))
+
+    if workers <= 1:
+        results = (_expand_file(path, out_path, options) for path, out_path in jobs)
+        return {path: error for path, error in results if error is not None}
+
+    # Imported here as it is slow to import, and only needed by this function.
+    from concurrent.futures import ProcessPoolExecutor
+
+    with ProcessPoolExecutor(
+        max_workers=workers, initializer=_init_worker, initargs=(options,)
+    ) as executor:
+        chunksize = max(1, len(jobs) // (4 * workers))
+        results = executor.map(_expand_file_in_worker, jobs, chunksize=chunksize)
+        return {path: error for path, error in results if error is not None}
+
+
+# The options of expand_files(), as received by each worker process.
+_worker_options = None
+
+
+def _init_worker(options):
+    global _worker_options
+    _worker_options = options
+
+
+def _expand_file_in_worker(job):
+    path, out_path = job
+    return _expand_file(path, out_path, _worker_options)
+
+
+def _expand_file(path, out_path, options):
+    import shutil
+    from tempfile import NamedTemporaryFile
+
+    environ, nounset, var_symbol, surrounded_vars_only, escape_char = options
+    environ = EnvironOverlay(environ)
+
+    tmp_path = None
+    try:
+        # Without translating the newlines, so that \r\n are kept as they are.
+        with open(path, newline="") as f, NamedTemporaryFile(
+            "w", newline="", dir=os.path.dirname(out_path) or ".", delete=False
+        ) as out:
+            tmp_path = out.name
+            for chunk in expand_stream(
+                f,
+                nounset=nounset,
+                environ=environ,
+                var_symbol=var_symbol,
+                surrounded_vars_only=surrounded_vars_only,
+                escape_char=escape_char,
+            ):
+                out.write(chunk)
+        shutil.copymode(path, tmp_path)
+        os.replace(tmp_path, out_path)
+    except Exception as e:
+        if tmp_path is not None:
+            os.unlink(tmp_path)
+        return path, e
+
+    return path, None
+
+
+def compile(
+    vars_,
+    var_symbol=VAR_SYMBOL,
+    surrounded_vars_only=False,
+    escape_char=ESCAPE_CHAR,
+):
+    """Parse variables once so that they can be expanded many times.
+
+    Params:
+        vars_ (str): Variables to parse.
+        var_symbol (str): Character used to identify a variable. Defaults to $
+        surrounded_vars_only (bool): If True, only variables in braces are expanded.
+        escape_char (str): Character used to escape the var_symbol. Defaults to \\
+
+    Returns:
+        Template: The parsed variables.
+
+    Example usage: ::
+
+        from expandvars import compile
+
+        template = compile("$HOST:${PORT:-8080}")
+
+        print(template.render(environ={"HOST": "localhost"}))
+        # localhost:8080
+
+        print(template.render(environ={"HOST": "example.com", "PORT": "80"}))
+        # example.com:80
+    """
+    if isinstance(vars_, TextIOWrapper):
+        # This is a file. Read it.
+        vars_ = vars_.read()
+
+    template, _ = _compile(
+        vars_,
+        var_symbol=var_symbol,
+        surrounded_vars_only=surrounded_vars_only,
+        escape_char=escape_char,
+    )
+    return template
+
+
+def compile_file(
+    path,
+    var_symbol=VAR_SYMBOL,
+    surrounded_vars_only=False,
+    escape_char=ESCAPE_CHAR,
+    cache_dir=None,
+    cache_size=DISK_CACHE_SIZE,
+):
+    """Parse a text file, optionally caching the result on disk.
+
+    With cache_dir, the parsed file is saved in that directory, and loaded
+    back the next time the same file is compiled with the same options, by
+    any process, instead of being parsed again. The saved files are only used
+    if the size, modification time and content of the file did not change.
+    Errors writing them are ignored.
+
+    As the saved files decide the output, cache_dir must only be writable by
+    the current user. It is created with no access for the others, and
+    where the owners of files are known, a cache_dir or saved file owned by
+    another user is never used.
+
+    Params:
+        path (str): The file to parse.
+        var_symbol (str): Character used to identify a variable. Defaults to $
+        surrounded_vars_only (bool): If True, only variables in braces are expanded.
+        escape_char (str): Character used to escape the var_symbol. Defaults to \\
+        cache_dir (str): The directory where to cache the parsed files, created if needed. Defaults to no cache.
+        cache_size (int): Maximum total size of the cached files, in bytes. The least recently used ones are deleted first.
+
+    Returns:
+        Template: The parsed variables.
+
+    Example usage: ::
+
+        import os
+        from expandvars import compile_file
 
-    pass
+        cache_dir = os.path.expanduser("~/.cache/expandvars")
+        template = compile_file("app.conf", cache_dir=cache_dir)
 
+        print(template.render())
+    """
+    with open(path) as f:
+        stat = os.fstat(f.fileno())
+        source = f.read()
 
-class MissingClosingBrace(ExpandvarsException, SyntaxError):
-    def __init__(self, param):
-        super().__init__("{0}: missing '}}'".format(param))
+    options = dict(
+        var_symbol=var_symbol,
+        surrounded_vars_only=surrounded_vars_only,
+        escape_char=escape_char,
+    )
+    if cache_dir is None:
+        return compile(source, **options)
 
+    import hashlib
 
-class MissingEscapedChar(ExpandvarsException, SyntaxError):
-    def __init__(self, param):
-        super().__init__("{0}: missing escaped character".format(param))
+    key = (os.path.abspath(path), var_symbol, surrounded_vars_only, escape_char)
+    key += (sys.implementation.cache_tag, _DISK_CACHE_FORMAT)
+    entry = os.path.join(
+        cache_dir, hashlib.sha256(repr(key).encode()).hexdigest() + ".cache"
+    )
 
+    nodes = _load_cached_nodes(entry, stat, source)
+    if nodes is not None:
+        return Template(source, nodes, **options)
 
-class OperandExpected(ExpandvarsException, SyntaxError):
-    def __init__(self, param, operand):
-        super().__init__(
-            "{0}: operand expected (error token is {1})".format(param, repr(operand))
-        )
+    template = compile(source, **options)
+    _save_cached_nodes(entry, stat, source, template._nodes, cache_size)
+    return template
 
 
-class NegativeSubStringExpression(ExpandvarsException, IndexError):
-    def __init__(self, param, expr):
-        super().__init__("{0}: {1}: substring expression < 0".format(param, expr))
+def _load_cached_nodes(entry, stat, source):
+    import marshal
 
+    try:
+        with open(entry, "rb") as f:
+            if not _owned(os.fstat(f.fileno())):
+                return None
+            if not _owned(os.stat(os.path.dirname(entry))):
+                return None
+            # Much faster than marshal.load(f), which reads bit by bit.
+            size, mtime, digest, flat = marshal.loads(f.read())
+        if (size, mtime) != (stat.st_size, stat.st_mtime_ns):
+            return None
+        if digest != _digest(source):
+            return None
+        nodes = _unflatten(flat)
+        # Mark it as recently used.
+        os.utime(entry)
+    except (OSError, EOFError, ValueError, TypeError, IndexError):
+        # Missing, or not written by this version.
+        return None
+    return nodes
+
+
+def _save_cached_nodes(entry, stat, source, nodes, cache_size):
+    import marshal
+    from tempfile import NamedTemporaryFile
+
+    data = marshal.dumps(
+        (stat.st_size, stat.st_mtime_ns, _digest(source), _flatten(nodes))
+    )
+    cache_dir = os.path.dirname(entry)
+    tmp_path = None
+    try:
+        os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+        if not _owned(os.stat(cache_dir)):
+            return
+        # Written atomically, as other processes may be reading it.
+        with NamedTemporaryFile(
+            "wb", dir=cache_dir, suffix=".tmp", delete=False
+        ) as out:
+            tmp_path = out.name
+            out.write(data)
+        os.replace(tmp_path, entry)
+        tmp_path = None
+        _trim_cache_dir(cache_dir, cache_size)
+    except OSError:
+        pass
+    finally:
+        if tmp_path is not None:
+            os.unlink(tmp_path)
+
+
+def _owned(stat):
+    """Whether the file is owned by the current user, or owners aren't known."""
+    getuid = getattr(os, "getuid", None)
+    return getuid is None or stat.st_uid == getuid()
+
+
+def _trim_cache_dir(cache_dir, cache_size):
+    """Delete the least recently used files until they fit in cache_size."""
+    entries, total = [], 0
+    for entry in os.scandir(cache_dir):
+        if entry.name.endswith(".cache"):
+            stat = entry.stat()
+            entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+            total += stat.st_size
+
+    entries.sort()
+    for _, size, path in entries:
+        if total <= cache_size:
+            break
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            # Deleted by another process.
+            pass
+        total -= size
+
+
+def _digest(source):
+    import hashlib
+
+    return hashlib.sha256(source.encode("utf-8", "surrogatepass")).digest()
+
+
+def _flatten(nodes):
+    """Serialize the nodes as a flat tuple, in depth-first order.
+
+    Each _Var becomes a tuple of its attributes and the number of nodes of
+    its operand, which follow it, or -1 if it has none. Literals are kept as
+    they are. Unlike nested tuples, this works at any depth of nesting.
+    """
+    flat, stack = [], [iter(nodes)]
+    while stack:
+        node = next(stack[-1], None)
+        if node is None:
+            stack.pop()
+        elif type(node) is _Var:
+            operand = node.operand
+            flat.append(
+                (
+                    node.name,
+                    node.indirect,
+                    node.modifier_type,
+                    node.offset,
+                    node.length,
+                    node.position,
+                    node.split,
+                    -1 if operand is None else len(operand),
+                )
+            )
+            if operand:
+                stack.append(iter(operand))
+        else:
+            flat.append(node)
+    return tuple(flat)
+
+
+def _unflatten(flat):
+    """Rebuild the nodes serialized by _flatten()."""
+    nodes, stack = [], []
+    # The node whose operand is being rebuilt, and how many nodes it still lacks.
+    owner, remaining = None, -1
+    for item in flat:
+        if type(item) is tuple:
+            name, indirect, modifier_type, offset, length, position, split, size = item
+            node = _Var(name, indirect, modifier_type, None if size < 0 else ())
+            node.offset, node.length = offset, length
+            node.position, node.split = position, split
+        else:
+            node = item
+        nodes.append(node)
+        remaining -= 1
+
+        if type(item) is tuple and size > 0:
+            stack.append((nodes, owner, remaining))
+            nodes, owner, remaining = [], node, size
+
+        while remaining == 0:
+            owner.operand = tuple(nodes)
+            nodes, owner, remaining = stack.pop()
+
+    if stack:
+        raise ValueError("truncated")
+    return tuple(nodes)
+
+
+def _compile(vars_, var_symbol, surrounded_vars_only, escape_char, final=True):
+    nodes, pos = _parse(
+        vars_,
+        var_symbol=var_symbol,
+        surrounded_vars_only=surrounded_vars_only,
+        escape_char=escape_char,
+        final=final,
+    )
+
+    template = Template(
+        vars_[:pos] if pos < len(vars_) else vars_,
+        nodes,
+        var_symbol=var_symbol,
+        surrounded_vars_only=surrounded_vars_only,
+        escape_char=escape_char,
+    )
+    return template, pos
+
+
+def expand_stream(
+    stream,
+    nounset=False,
+    environ=os.environ,
+    var_symbol=VAR_SYMBOL,
+    surrounded_vars_only=False,
+    escape_char=ESCAPE_CHAR,
+    chunk_size=CHUNK_SIZE,
+    max_pending=None,
+):
+    """Expand variables chunk by chunk, without reading everything at once.
 
-class BadSubstitution(ExpandvarsException, SyntaxError):
-    def __init__(self, param):
-        super().__init__("{0}: bad substitution".format(param))
+    Expressions may be split across chunks. Only the text of an expression
+    that isn't complete yet is held back until the next chunk arrives. Its
+    length can be limited with max_pending, to fail early on a stray ${ in a
+    huge input instead of holding back all the rest of it.
 
+    Params:
+        stream (Iterable[str]): A text file, or any iterable of strings to expand.
+        nounset (bool): If True, enables strict parsing (similar to set -u / set -o nounset in bash).
+        environ (Mapping): Elements to consider during variable expansion. Defaults to os.environ
+        var_symbol (str): Character used to identify a variable. Defaults to $
+        surrounded_vars_only (bool): If True, only variables in braces are expanded.
+        escape_char (str): Character used to escape the var_symbol. Defaults to \\
+        chunk_size (int): Number of characters to read at once from a file.
+        max_pending (int): Number of characters an expression may span before
+            MissingClosingBrace is raised. Unlimited by default.
 
-class ParameterNullOrNotSet(ExpandvarsException, KeyError):
-    def __init__(self, param, msg=None):
-        if msg is None:
-            msg = "parameter null or not set"
-        super().__init__("{0}: {1}".format(param, msg))
+    Returns:
+        Iterator[str]: Expanded chunks.
 
+    Example usage: ::
 
-class UnboundVariable(ExpandvarsException, KeyError):
-    def __init__(self, param):
-        super().__init__("{0}: unbound variable".format(param))
+        import sys
+        from expandvars import expand_stream
 
+        with open(somefile) as f:
+            for chunk in expand_stream(f):
+                sys.stdout.write(chunk)
+    """
+    if hasattr(stream, "read"):
+        stream = iter(partial(stream.read, chunk_size), "")
+
+    # The text not expanded yet, in pieces. While an expression is open, the
+    # new chunks are only scanned for braces, and it's parsed again once they
+    # are all closed, so that each character is parsed about once.
+    held, size, depth, final = [], 0, 0, False
+    # Location of the start of the held text in the stream, to locate the errors.
+    position, line, column = 0, 1, 1
+    chunks = iter(stream)
+    while not final:
+        chunk = next(chunks, None)
+        if chunk is None:
+            final = True
+        else:
+            held.append(chunk)
+            size += len(chunk)
+            if depth:
+                depth = _open_braces(chunk, depth)
+                if depth and (max_pending is None or size <= max_pending):
+                    continue
+
+        pending = "".join(held)
+        try:
+            template, pos = _compile(
+                pending,
+                var_symbol=var_symbol,
+                surrounded_vars_only=surrounded_vars_only,
+                escape_char=escape_char,
+                final=final,
+            )
+            if not pos and max_pending is not None and size > max_pending:
+                # Give up on an expression that doesn't end, e.g. a stray ${
+                _compile(pending, var_symbol, surrounded_vars_only, escape_char)
+            expanded = template.render(environ=environ, nounset=nounset)
+        except ExpandvarsException as e:
+            if e.position is not None:
+                if e.line == 1:
+                    e.column += column - 1
+                e.position += position
+                e.line += line - 1
+            raise
+
+        pending = pending[pos:]
+        held, size = [pending], len(pending)
+        depth = _open_braces(pending, 0)
+        position += pos
+        newlines = template.source.count("\n")
+        if newlines:
+            line += newlines
+            column = pos - template.source.rfind("\n")
+        else:
+            column += pos
 
-class InvalidIndirectExpansion(ExpandvarsException, KeyError):
-    def __init__(self, param):
-        super().__init__("{0}: invalid indirect expansion".format(param))
+        if expanded:
+            yield expanded
 
 
-def getenv(var, indirect, environ, var_symbol=VAR_SYMBOL):
-    """Get value from environment variable.
+def _open_braces(text, depth):
+    """Count the braces still open after text, or 0 as soon as none is."""
+    for match in _TEXT_SYNTAX.brace_re.finditer(text):
+        if match.lastindex:
+            depth += 1
+        elif depth:
+            depth -= 1
+            if not depth:
+                return 0
+    return depth
 
-    When indirect is True, it will use the value of the resolved variable as
-    the name of the final variable.
-    """
 
-    if var == var_symbol:
-        return str(os.getpid())
+class Template:
+    """Variables parsed by compile(), ready to be expanded.
 
-    val = environ.get(var)
+    A template only holds the result of parsing, so it can be rendered any
+    number of times, with different environments, and from multiple threads.
+    """
 
-    if indirect:
-        if val is None:
-            raise InvalidIndirectExpansion(var)
-        else:
-            val = getenv(
-                val,
-                indirect=False,
+    __slots__ = (
+        "source",
+        "var_symbol",
+        "surrounded_vars_only",
+        "escape_char",
+        "_nodes",
+    )
+
+    def __init__(
+        self,
+        source,
+        nodes,
+        var_symbol=VAR_SYMBOL,
+        surrounded_vars_only=False,
+        escape_char=ESCAPE_CHAR,
+    ):
+        self.source = source
+        self.var_symbol = var_symbol
+        self.surrounded_vars_only = surrounded_vars_only
+        self.escape_char = escape_char
+        self._nodes = nodes
+
+    def __repr__(self):
+        return "Template({0!r})".format(self.source)
+
+    def render(self, environ=os.environ, nounset=False, stats=None, on_lookup=None):
+        """Expand the parsed variables.
+
+        If environ has a get_many(names) method, it is called once with all the
+        variables that may be needed, instead of calling get() for each one.
+        It must return a mapping, where the variables that are not set can
+        be left out. Indirect references need a second call.
+
+        Templates compiled from bytes-like text are rendered as bytes, and
+        environ must then have bytes names and values, like os.environb.
+
+        Params:
+            environ (Mapping): Elements to consider during variable expansion. Defaults to os.environ, or os.environb for bytes
+            nounset (bool): If True, enables strict parsing (similar to set -u / set -o nounset in bash).
+            stats (Stats): If given, the counters to update. See Stats.
+            on_lookup (callable): If given, called as on_lookup(name, found, elapsed) after each variable lookup, elapsed being in seconds. Variables are then looked up one by one, even if environ has a get_many() method.
+
+        Returns:
+            str: Expanded values, or bytes.
+        """
+        if not isinstance(self.source, str):
+            environ = self._bytes_environ(environ)
+
+        if stats is not None or on_lookup is not None:
+            return self._render_instrumented(environ, nounset, stats, on_lookup)
+
+        if hasattr(environ, "get_many"):
+            environ = self._prefetch(environ, nounset)
+
+        return self._render(environ, nounset)
+
+    def iter_render(self, environ=os.environ, nounset=False):
+        """Expand the parsed variables piece by piece. See iter_expand().
+
+        The variables are looked up as the pieces are consumed, except if
+        environ has a get_many() method, which is called upfront.
+
+        Params:
+            environ (Mapping): Elements to consider during variable expansion. Defaults to os.environ, or os.environb for bytes
+            nounset (bool): If True, enables strict parsing (similar to set -u / set -o nounset in bash).
+
+        Returns:
+            Iterator[str]: Non-empty pieces of the expanded text, or bytes.
+        """
+        if not isinstance(self.source, str):
+            environ = self._bytes_environ(environ)
+
+        if hasattr(environ, "get_many"):
+            environ = self._prefetch(environ, nounset)
+
+        for node in self._nodes:
+            if type(node) is not _Var:
+                yield node
+                continue
+
+            piece = self._render(environ, nounset, nodes=(node,))
+            if piece:
+                yield piece
+
+    def _bytes_environ(self, environ):
+        if environ is os.environ:
+            # There is no os.environb on Windows, where the environment is text.
+            if os.supports_bytes_environ:
+                environ = os.environb
+            else:
+                environ = _FsEncodedEnviron(environ)
+        return _BytesEnviron(environ)
+
+    def _prefetch(self, environ, nounset):
+        environ = _MemoizedEnviron(environ)
+        environ.prefetch(self._nodes, self.var_symbol, nounset=nounset)
+        return environ
+
+    def _render_instrumented(self, environ, nounset, stats, on_lookup):
+        if stats is None:
+            stats = Stats()
+        environ = _InstrumentedEnviron(environ, stats, on_lookup)
+
+        start = perf_counter()
+        try:
+            return self._render(environ, nounset, modify=environ.modify)
+        finally:
+            stats.expansions += 1
+            stats.chars += len(self.source)
+            stats.time += perf_counter() - start
+
+    def _render(self, environ, nounset, modify=None, nodes=None):
+        try:
+            return _render(
+                self._nodes if nodes is None else nodes,
+                nounset=nounset,
                 environ=environ,
-                var_symbol=var_symbol,
+                var_symbol=self.var_symbol,
+                modify=modify,
+                binary=not isinstance(self.source, str),
             )
+        except BadSubstitution as e:
+            raise _syntax_error(BadSubstitution, self.source, e.position, e.var)
+        except ExpandvarsException as e:
+            raise _locate(e, self.source, e.position, e.var)
+
+    def referenced_vars(self):
+        """List the variables used, without expanding anything.
+
+        Variables used in the operand of a modifier are listed too, whether or
+        not the operand would be expanded.
+
+        Returns:
+            References: The names of the variables, by kind of reference.
+        """
+        references = {kind: set() for kind in References._fields}
+        for node in _iter_vars(self._nodes):
+            if node.name == self.var_symbol:
+                continue
+            elif node.indirect:
+                references["indirect"].add(node.name)
+            else:
+                kind = _REFERENCE_KINDS.get(node.modifier_type, "direct")
+                references[kind].add(node.name)
 
-    return val
+        return References(**{k: frozenset(v) for k, v in references.items()})
 
 
-def expand(
+class References(
+    namedtuple("References", ["direct", "indirect", "defaulted", "assigned", "length"])
+):
+    """The variables used by a template, by kind of reference.
+
+    Attributes:
+        direct (frozenset): Variables expanded as is, e.g. $VAR, ${VAR:?} or ${VAR:1:2}.
+        indirect (frozenset): Variables holding the name of another one, e.g. ${!VAR}.
+        defaulted (frozenset): Variables with a default value, e.g. ${VAR:-default}.
+        assigned (frozenset): Variables assigned a default value, e.g. ${VAR:=default}.
+        length (frozenset): Variables whose length is expanded, e.g. ${#VAR}.
+    """
+
+    __slots__ = ()
+
+    @property
+    def names(self):
+        """frozenset: All the variables, whatever the kind of reference."""
+        return frozenset().union(*self)
+
+
+class TemplateSet:
+    """Templates rendered together, and re-rendered only when needed.
+
+    The variables each template looks up while being rendered are indexed,
+    so that when some variables change, only the templates that used them
+    are rendered again. This includes the targets of indirect references
+    like ${!VAR}. Assignments like ${VAR:=default} are visible to the other
+    templates, which are re-rendered if the assignment changed the value.
+
+    The templates are rendered in the order they were added. Those that fail
+    to render are left out of the outputs, and their error is kept in the
+    errors attribute instead.
+
+    Params:
+        texts (Mapping): The text of each template, by key. More can be added with add().
+        environ (Mapping): Elements to consider during variable expansion. Defaults to os.environ
+        nounset (bool): If True, enables strict parsing (similar to set -u / set -o nounset in bash).
+        var_symbol (str): Character used to identify a variable. Defaults to $
+        surrounded_vars_only (bool): If True, only variables in braces are expanded.
+        escape_char (str): Character used to escape the var_symbol. Defaults to \\
+
+    Example usage: ::
+
+        from expandvars import TemplateSet
+
+        environ = {"HOST": "localhost", "PORT": "8080"}
+        templates = TemplateSet(
+            {"app.conf": "url = http://$HOST:$PORT", "db.conf": "host = $HOST"},
+            environ=environ,
+        )
+
+        environ["PORT"] = "80"
+        for key in templates.refresh(["PORT"]):
+            print(key, templates[key])
+        # app.conf url = http://localhost:80
+    """
+
+    def __init__(
+        self,
+        texts=(),
+        environ=os.environ,
+        nounset=False,
+        var_symbol=VAR_SYMBOL,
+        surrounded_vars_only=False,
+        escape_char=ESCAPE_CHAR,
+    ):
+        self.environ = environ
+        self.nounset = nounset
+        self.errors = {}
+        self._options = dict(
+            var_symbol=var_symbol,
+            surrounded_vars_only=surrounded_vars_only,
+            escape_char=escape_char,
+        )
+        self._templates = {}
+        self._outputs = {}
+        self._order = {}
+        self._dependencies = {}
+        self._dependents = {}
+
+        for key, text in dict(texts).items():
+            self.add(key, text)
+
+    def __getitem__(self, key):
+        """The output of the template, or its error raised again."""
+        if key in self.errors:
+            raise self.errors[key]
+        return self._outputs[key]
+
+    def __contains__(self, key):
+        return key in self._templates
+
+    def __iter__(self):
+        return iter(self._templates)
+
+    def __len__(self):
+        return len(self._templates)
+
+    def add(self, key, text):
+        """Parse and render a template, replacing the one with the same key.
+
+        Returns:
+            set: The keys of the templates whose output changed, including this one.
+        """
+        template = compile(text, **self._options)
+        self._order.setdefault(key, len(self._order))
+        self._templates[key] = template
+        self._outputs.pop(key, None)
+        self.errors.pop(key, None)
+        return self._render({key}) | {key}
+
+    def remove(self, key):
+        """Forget a template."""
+        del self._templates[key]
+        self._outputs.pop(key, None)
+        self.errors.pop(key, None)
+        self._index(key, ())
+
+    def dependencies(self, key):
+        """The variables looked up by the template when last rendered.
+
+        Returns:
+            frozenset: The names of the variables.
+        """
+        return self._dependencies[key]
+
+    def refresh(self, changed=None):
+        """Render the templates that use the changed variables again.
+
+        Params:
+            changed (Iterable[str]): The names of the variables that changed in environ. Defaults to all of them, rendering every template.
+
+        Returns:
+            set: The keys of the templates whose output changed.
+        """
+        if changed is None:
+            return self._render(set(self._templates))
+
+        keys = set()
+        for name in changed:
+            keys.update(self._dependents.get(name, ()))
+        return self._render(keys)
+
+    def _render(self, keys):
+        # Render in order, going back to the templates that read a variable
+        # whenever another one assigns it.
+        heap = [(self._order[key], key) for key in keys]
+        heapq.heapify(heap)
+        queued, changed = set(keys), set()
+
+        while heap:
+            _, key = heapq.heappop(heap)
+            queued.discard(key)
+
+            environ = _RecordingEnviron(self.environ)
+            previous = self._outputs.get(key), self.errors.get(key)
+            try:
+                self._outputs[key] = self._templates[key].render(
+                    environ=environ, nounset=self.nounset
+                )
+                self.errors.pop(key, None)
+            except ExpandvarsException as e:
+                self._outputs.pop(key, None)
+                self.errors[key] = e
+            self._index(key, environ.names)
+
+            if self._outputs.get(key) != previous[0] or _error_changed(
+                previous[1], self.errors.get(key)
+            ):
+                changed.add(key)
+
+            for name in environ.assigned:
+                for dependent in self._dependents.get(name, ()):
+                    if dependent not in queued:
+                        queued.add(dependent)
+                        heapq.heappush(heap, (self._order[dependent], dependent))
+
+        return changed
+
+    def _index(self, key, names):
+        for name in self._dependencies.pop(key, ()):
+            self._dependents[name].discard(key)
+        if key in self._templates:
+            self._dependencies[key] = frozenset(names)
+            for name in names:
+                self._dependents.setdefault(name, set()).add(key)
+
+
+def _error_changed(previous, error):
+    if previous is None or error is None:
+        return previous is not error
+    return type(previous) is not type(error) or str(previous) != str(error)
+
+
+class Stats:
+    """Counters updated by expand() and Template.render() when passed as stats.
+
+    Attributes:
+        expansions (int): Number of strings expanded.
+        chars (int): Number of characters expanded.
+        lookups (int): Number of variables looked up.
+        unset (int): Number of variables looked up that were not set.
+        recovered_null (int): Number of times EXPANDVARS_RECOVER_NULL was used instead of raising an error.
+        defaults (int): Number of defaults used, by ${VAR:-default} or ${VAR:=default}.
+        assignments (int): Number of variables set by ${VAR:=default}.
+        time (float): Time spent expanding, in seconds.
+
+    Example usage: ::
+
+        from expandvars import Stats, expand
+
+        stats = Stats()
+        for line in lines:
+            expand(line, stats=stats)
+
+        print(stats)
+        # Stats(expansions=3, chars=42, lookups=5, unset=1, ...)
+    """
+
+    __slots__ = (
+        "expansions",
+        "chars",
+        "lookups",
+        "unset",
+        "recovered_null",
+        "defaults",
+        "assignments",
+        "time",
+    )
+
+    def __init__(self):
+        self.reset()
+
+    def __repr__(self):
+        return "Stats({0})".format(
+            ", ".join(
+                "{0}={1!r}".format(name, getattr(self, name)) for name in self.__slots__
+            )
+        )
+
+    def reset(self):
+        """Set all the counters back to 0."""
+        for name in self.__slots__:
+            setattr(self, name, 0)
+        self.time = 0.0
+
+
+class _Var:
+    """A variable reference inside a parsed template.
+
+    The operand is the parsed text following the modifier, or None when there
+    is nothing left to expand, e.g. when the offset and length of a substring
+    expression could be computed ahead of time. The operand of ${VAR/a/b} is
+    split in two, its first split nodes being the pattern.
+    """
+
+    __slots__ = (
+        "name",
+        "indirect",
+        "modifier_type",
+        "operand",
+        "offset",
+        "length",
+        "position",
+        "split",
+    )
+
+    def __init__(self, name, indirect, modifier_type, operand):
+        self.name = name
+        self.indirect = indirect
+        self.modifier_type = modifier_type
+        self.operand = operand
+        self.offset = 0
+        self.length = None
+        self.position = None
+        self.split = None
+
+
+def referenced_vars(
     vars_,
-    nounset=False,
-    environ=os.environ,
     var_symbol=VAR_SYMBOL,
     surrounded_vars_only=False,
     escape_char=ESCAPE_CHAR,
 ):
-    """Expand variables Unix style.
+    """List the variables used, without expanding anything.
 
     Params:
-        vars_ (str):  Variables to expand.
-        nounset (bool): If True, enables strict parsing (similar to set -u / set -o nounset in bash).
-        environ (Mapping): Elements to consider during variable expansion. Defaults to os.environ
+        vars_ (str): Variables to inspect.
         var_symbol (str): Character used to identify a variable. Defaults to $
+        surrounded_vars_only (bool): If True, only variables in braces are expanded.
+        escape_char (str): Character used to escape the var_symbol. Defaults to \\
 
     Returns:
-        str: Expanded values.
+        References: The names of the variables, by kind of reference.
 
     Example usage: ::
 
-        from expandvars import expand
+        from expandvars import referenced_vars
 
-        print(expand("%PATH:$HOME/bin:%{SOME_UNDEFINED_PATH:-/default/path}", environ={"PATH": "/example"}, var_symbol="%"))
-        # /example:$HOME/bin:/default/path
+        refs = referenced_vars("$HOST:${PORT:-${DEFAULT_PORT}}")
 
-        # Or
-        with open(somefile) as f:
-            print(expand(f))
-    """
-    if isinstance(vars_, TextIOWrapper):
-        # This is a file. Read it.
-        vars_ = vars_.read()
+        print(sorted(refs.names))
+        # ['DEFAULT_PORT', 'HOST', 'PORT']
 
-    if len(vars_) == 0:
-        return ""
+        print(refs.defaulted)
+        # frozenset({'PORT'})
+    """
+    if _nothing_to_expand(vars_, var_symbol, escape_char):
+        return References(*[frozenset()] * len(References._fields))
 
-    buff = []
+    template = _get_template(vars_, var_symbol, surrounded_vars_only, escape_char)
+    return template.referenced_vars()
 
-    vars_iter = _PeekableIterator(vars_)
-    try:
-        for c in vars_iter:
-            if escape_char and c == escape_char:
-                next_ = vars_iter.peek()
-                if next_ == var_symbol or next_ == escape_char:
-                    buff.append(next(vars_iter))
-                elif next_ == _PeekableIterator.NOTHING:
-                    raise MissingEscapedChar(c)
-                else:
-                    buff.append(c)
-                    buff.append(next(vars_iter))
-            elif c == var_symbol:
-                next_ = vars_iter.peek()
-                if next_ == _PeekableIterator.NOTHING:
-                    buff.append(c)
-                elif surrounded_vars_only and next_ != "{":
-                    buff.append(c)
-                elif _valid_char(next_) or next_ == "{" or next_ == var_symbol:
-                    val = _expand_var(
-                        vars_iter,
-                        nounset=nounset,
-                        environ=environ,
-                        var_symbol=var_symbol,
-                    )
-                    buff.append(val)
-                else:
-                    buff.append(c)
-            else:
-                buff.append(c)
-        return "".join(buff)
-    except MissingEscapedChar:
-        raise MissingEscapedChar(vars_)
-    except MissingClosingBrace:
-        raise MissingClosingBrace(vars_)
-    except BadSubstitution:
-        raise BadSubstitution(vars_)
 
+def set_cache_maxsize(maxsize=CACHE_MAXSIZE):
+    """Resize the cache of parsed strings used by expand().
 
-def expandvars(vars_, nounset=False):
-    """Expand system variables Unix style.
+    The least recently used strings are evicted first, approximately, see
+    _Cache. Resizing the cache also clears it.
 
     Params:
-        vars_ (str): System variables to expand.
-        nounset (bool): If True, enables strict parsing (similar to set -u / set -o nounset in bash).
+        maxsize (int): Number of parsed strings to keep. 0 or less disables the cache, None makes it unbounded.
+    """
+    global _compile_cached
+    _compile_cached = _Cache(compile, maxsize)
+
+
+def cache_info():
+    """Report the statistics of the cache of parsed strings used by expand().
 
     Returns:
-        str: Expanded values.
+        CacheInfo: A named tuple with hits, misses, maxsize and currsize.
+    """
+    return _compile_cached.cache_info()
 
-    Example usage: ::
 
-        from expandvars import expandvars
+def cache_clear():
+    """Empty the cache of parsed strings used by expand()."""
+    _compile_cached.cache_clear()
 
-        print(expandvars("$PATH:$HOME/bin:${SOME_UNDEFINED_PATH:-/default/path}"))
-        # /bin:/sbin:/usr/bin:/usr/sbin:/home/you/bin:/default/path
 
-        # Or
-        with open(somefile) as f:
-            print(expandvars(f))
+_CacheInfo = namedtuple("CacheInfo", "hits misses maxsize currsize")
+
+
+class _Cache:
+    """Like functools.lru_cache, but without locking on hits.
+
+    The templates are immutable once parsed, so they can be shared by all the
+    threads. Finding one in the cache only reads a dict, so that threads never
+    wait for each other, unlike with lru_cache, which takes a lock on every
+    call in free-threaded builds of Python. Only adding an entry takes the
+    lock.
+
+    Entries are evicted in insertion order, except the ones hit since they
+    were added or last considered, which get a second chance at the end of
+    the queue (the CLOCK algorithm, close to least recently used). The hits
+    and misses are counted without locking, so they may be slightly off when
+    threads race.
     """
-    return expand(vars_, nounset=nounset)
+
+    def __init__(self, func, maxsize):
+        update_wrapper(self, func)
+        self.func = func
+        # Like lru_cache, negative sizes disable the cache.
+        self.maxsize = maxsize if maxsize is None or maxsize > 0 else 0
+        self.hits = self.misses = 0
+        # Arguments -> [result, hit since added or last considered]
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, *args):
+        entry = self._entries.get(args)
+        if entry is not None:
+            self.hits += 1
+            if not entry[1]:
+                entry[1] = True
+            return entry[0]
+
+        self.misses += 1
+        result = self.func(*args)
+        if self.maxsize != 0:
+            with self._lock:
+                self._add(args, result)
+        return result
+
+    def _add(self, args, result):
+        entries = self._entries
+        if args in entries:
+            # Added by another thread in the meantime.
+            return
+
+        while self.maxsize is not None and len(entries) >= self.maxsize:
+            oldest = next(iter(entries))
+            entry = entries.pop(oldest)
+            if entry[1]:
+                entry[1] = False
+                entries[oldest] = entry
+
+        entries[args] = [result, False]
+
+    def cache_info(self):
+        return _CacheInfo(self.hits, self.misses, self.maxsize, len(self._entries))
+
+    def cache_clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = 0
+
+
+def _cached(maxsize):
+    """Decorate a function with a _Cache."""
+    return partial(_Cache, maxsize=maxsize)
+
+
+_compile_cached = _Cache(compile, CACHE_MAXSIZE)
 
 
 class ModifierType:
@@ -212,108 +2006,567 @@ class ModifierType:
     OFFSET = 4
     STRICT = 5
     LENGTH = 6
+    REMOVE_PREFIX = 7
+    REMOVE_LONGEST_PREFIX = 8
+    REMOVE_SUFFIX = 9
+    REMOVE_LONGEST_SUFFIX = 10
+    REPLACE = 11
+    REPLACE_ALL = 12
+    REPLACE_PREFIX = 13
+    REPLACE_SUFFIX = 14
+    UPPERCASE_FIRST = 15
+    UPPERCASE = 16
+    LOWERCASE_FIRST = 17
+    LOWERCASE = 18
+
+
+# Kinds of References, by modifier type. Anything else is a direct reference.
+_REFERENCE_KINDS = {
+    ModifierType.GET_DEFAULT: "defaulted",
+    ModifierType.GET_OR_SET_DEFAULT: "assigned",
+    ModifierType.LENGTH: "length",
+}
+
+# Modifiers whose operand is only used when the variable is null or unset.
+_DEFAULT_MODIFIERS = frozenset(
+    (
+        ModifierType.GET_DEFAULT,
+        ModifierType.GET_OR_SET_DEFAULT,
+        ModifierType.STRICT,
+    )
+)
+
+
+# The modifiers written with a pattern operator, e.g. ${VAR#pattern}, by
+# operator, when used alone and when doubled, e.g. ${VAR##pattern}.
+_PATTERN_MODIFIERS = {
+    "#": (ModifierType.REMOVE_PREFIX, ModifierType.REMOVE_LONGEST_PREFIX),
+    "%": (ModifierType.REMOVE_SUFFIX, ModifierType.REMOVE_LONGEST_SUFFIX),
+    "/": (ModifierType.REPLACE, ModifierType.REPLACE_ALL),
+    "^": (ModifierType.UPPERCASE_FIRST, ModifierType.UPPERCASE),
+    ",": (ModifierType.LOWERCASE_FIRST, ModifierType.LOWERCASE),
+}
+_PATTERN_MODIFIERS.update(
+    {op.encode("latin-1"): types for op, types in _PATTERN_MODIFIERS.items()}
+)
+
+# Modifiers applied with _modify_pattern().
+_PATTERN_MODIFIER_TYPES = frozenset(
+    types for types in _PATTERN_MODIFIERS.values() for types in types
+) | frozenset((ModifierType.REPLACE_PREFIX, ModifierType.REPLACE_SUFFIX))
+
+# Modifiers whose operand is a pattern and a replacement, e.g. ${VAR/a/b}.
+_REPLACE_MODIFIERS = frozenset(
+    (
+        ModifierType.REPLACE,
+        ModifierType.REPLACE_ALL,
+        ModifierType.REPLACE_PREFIX,
+        ModifierType.REPLACE_SUFFIX,
+    )
+)
+
+# Modifiers converting the case of the value, e.g. ${VAR^^}.
+_CASE_MODIFIERS = frozenset(
+    (
+        ModifierType.UPPERCASE_FIRST,
+        ModifierType.UPPERCASE,
+        ModifierType.LOWERCASE_FIRST,
+        ModifierType.LOWERCASE,
+    )
+)
 
 
-class State:
-    READING_VAR = 1
-    READING_MODIFIER_VAR = 2
-    READING_MODIFIER = 3
-    FINISHED_READING = -1
+def _valid_char(char):
+    return char.isalnum() or char == "_"
 
 
-def _read_var(buff, var_symbol):
-    name = []
-    state = State.READING_VAR
-    next_ = buff.peek()
-    modifier, modifier_type = [], None
-    bracedepth = 0
-    indirect = False
+# The characters of the syntax, as text or as bytes, with the patterns of the
+# runs of characters accepted by valid_char() and of the braces.
+_Syntax = namedtuple(
+    "_Syntax",
+    "empty lbrace rbrace bang hash colon minus equals plus question percent "
+    "slash caret comma escape_char name_re brace_re valid_char",
+)
+
+_TEXT_SYNTAX = _Syntax(
+    "",
+    "{",
+    "}",
+    "!",
+    "#",
+    ":",
+    "-",
+    "=",
+    "+",
+    "?",
+    "%",
+    "/",
+    "^",
+    ",",
+    ESCAPE_CHAR,
+    re.compile(r"\w+"),
+    re.compile(r"(\{)|\}"),
+    _valid_char,
+)
+
+_BYTES_SYNTAX = _Syntax(
+    *(c.encode("latin-1") for c in _TEXT_SYNTAX[:15]),
+    re.compile(rb"\w+"),
+    re.compile(rb"(\{)|\}"),
+    # Slices of a memoryview are memoryviews, which have no isalnum().
+    lambda char: bytes(char).isalnum() or char == b"_",
+)
+
+_NEWLINE_RE = {str: re.compile("\n"), bytes: re.compile(b"\n")}
+
+
+@_cached(maxsize=32)
+def _special_chars_re(var_symbol, escape_char):
+    # Only single characters can ever match, longer symbols are never found.
+    chars = [c for c in (var_symbol, escape_char) if c and len(c) == 1]
+    if not chars:
+        return None
+    separator = "|" if isinstance(chars[0], str) else b"|"
+    return re.compile(separator.join(re.escape(c) for c in chars))
+
+
+class _Incomplete(Exception):
+    """Raised instead of a syntax error when more input may complete it."""
+
+
+def _parse(vars_, var_symbol, surrounded_vars_only, escape_char, final=True):
+    """Split the variables into literal strings and _Var nodes.
+
+    Instead of visiting every character, it jumps from one var_symbol or
+    escape_char to the next, copying the text in between as is. Operands are
+    parsed in place with an explicit stack, and their closing brace is found
+    by jumping over the nested pairs of braces, so the time taken is linear
+    however deep the nesting.
+
+    When final is False, vars_ is only the beginning of the input, so parsing
+    stops before any expression that more input could still complete.
+
+    Bytes-like vars_, e.g. bytes or mmap.mmap, are parsed as they are, their
+    literal parts being sliced from them, and the names of the variables
+    being decoded from latin-1.
 
-    while state != State.FINISHED_READING:
-        next_ = buff.peek()
+    Returns:
+        tuple: The nodes, and the position up to which vars_ was parsed.
+    """
+    if isinstance(vars_, str):
+        syntax = _TEXT_SYNTAX
+    else:
+        syntax = _BYTES_SYNTAX
+        var_symbol = var_symbol.encode("latin-1")
+        escape_char = escape_char and escape_char.encode("latin-1")
+
+    top_syntax = (
+        _special_chars_re(var_symbol, escape_char),
+        escape_char,
+        surrounded_vars_only,
+    )
+    if top_syntax[0] is None:
+        return ((vars_[:],) if vars_ else ()), len(vars_)
+
+    # Operands are parsed with the default options, whatever the top level's.
+    operand_syntax = (
+        _special_chars_re(var_symbol, syntax.escape_char),
+        syntax.escape_char,
+        False,
+    )
+    empty, lbrace, valid_char, brace_re = (
+        syntax.empty,
+        syntax.lbrace,
+        syntax.valid_char,
+        syntax.brace_re,
+    )
+
+    special, escape_char, surrounded_vars_only = top_syntax
+    braces = {}
+    stack = []
+    nodes, buff, pos, end, owner = [], [], 0, len(vars_), None
+
+    while True:
+        match = special.search(vars_, pos, end)
+        if match is None:
+            if pos < end:
+                buff.append(vars_[pos:end])
+            if buff:
+                nodes.append(empty.join(buff))
+            if not stack:
+                return tuple(nodes), end
+
+            # The operand is complete, resume parsing its parent.
+            _set_operand(owner, tuple(nodes))
+            nodes, buff, pos, end, owner = stack.pop()
+            if not stack:
+                special, escape_char, surrounded_vars_only = top_syntax
+            continue
+
+        index = match.start()
+        if index > pos:
+            buff.append(vars_[pos:index])
+
+        c = vars_[index : index + 1]
+        next_ = vars_[index + 1 : index + 2] if index + 1 < end else empty
+        pos = index + 2
+        partial = not final and not stack
+
+        try:
+            if not next_ and partial:
+                raise _Incomplete()
+            elif escape_char and c == escape_char:
+                if not next_:
+                    raise _syntax_error(MissingEscapedChar, vars_, index)
+                elif next_ == var_symbol or next_ == escape_char:
+                    buff.append(next_)
+                else:
+                    buff.append(vars_[index:pos])
+                continue
+            elif (
+                not next_
+                or (surrounded_vars_only and next_ != lbrace)
+                or not (valid_char(next_) or next_ == lbrace or next_ == var_symbol)
+            ):
+                buff.append(c)
+                pos = index + 1
+                continue
 
-        if next_ == _PeekableIterator.NOTHING:
-            if state == State.READING_MODIFIER_VAR or state == State.READING_MODIFIER:
-                raise MissingClosingBrace("".join(name))
-            else:
-                state = State.FINISHED_READING
-
-        elif next_ == "{" and state == State.READING_VAR:
-            next(buff)
-            if buff.peek() == "!":
-                indirect = True
-                next(buff)
-            elif buff.peek() == "#":
-                modifier_type = ModifierType.LENGTH
-                next(buff)
-            state = State.READING_MODIFIER_VAR
-
-        elif next_ == "}" and state == State.READING_MODIFIER_VAR:
-            next(buff)
-            state = State.FINISHED_READING
-
-        elif (_valid_char(next_) or (next_ == var_symbol and not name)) and (
-            state == State.READING_VAR or state == State.READING_MODIFIER_VAR
-        ):
-            name.append(next(buff))
+            node, pos, scan = _parse_var(
+                vars_, index + 1, end, var_symbol, syntax, partial
+            )
+            if scan is not None:
+                close = _find_closing_brace(vars_, scan, end, braces, brace_re)
+                if close is None:
+                    raise _unclosed(vars_, index, node.name, partial)
+        except _Incomplete:
+            if buff:
+                nodes.append(empty.join(buff))
+            return tuple(nodes), index
+
+        if not node.name:
+            raise _syntax_error(BadSubstitution, vars_, index)
+        if syntax is _BYTES_SYNTAX:
+            node.name = _latin1(node.name)
+        node.position = index
+
+        if buff:
+            nodes.append(empty.join(buff))
+            buff = []
+        nodes.append(node)
+
+        if scan is not None:
+            if len(stack) >= MAX_DEPTH:
+                raise _syntax_error(NestingTooDeep, vars_, index, node.name, MAX_DEPTH)
+
+            # Parse the operand, in [pos, close), before going on.
+            stack.append((nodes, buff, close + 1, end, owner))
+            nodes, buff, end, owner = [], [], close, node
+            special, escape_char, surrounded_vars_only = operand_syntax
+
+
+def _parse_var(vars_, pos, end, var_symbol, syntax, partial=False):
+    """Parse the variable starting at pos, right after the var_symbol.
 
-        elif next_ == ":" and state == State.READING_MODIFIER_VAR:
-            state = State.READING_MODIFIER
-            next(buff)
+    Returns:
+        tuple: The _Var node, and the position where the variable ends. Or,
+            if it has an operand, the position where the operand starts and
+            the position from which to look for its closing brace.
+    """
+    (
+        empty,
+        lbrace,
+        rbrace,
+        bang,
+        hash_,
+        colon_,
+        minus,
+        equals,
+        plus,
+        question,
+        percent,
+        slash,
+        caret,
+        comma,
+        _,
+        name_re,
+        _,
+        _,
+    ) = syntax
+    name, indirect, modifier_type = empty, False, None
+    start = pos - 1
+
+    # $VAR, $$, or the part of the name that precedes a brace, e.g. $VAR{...}
+    while True:
+        next_ = vars_[pos : pos + 1] if pos < end else empty
+        if next_ == lbrace:
+            break
+        elif not next_ and partial:
+            raise _Incomplete()
+        elif next_ == var_symbol and not name:
+            name, pos = var_symbol, pos + 1
+        else:
+            match = name_re.match(vars_, pos, end)
+            if match is None:
+                return _Var(name, indirect, modifier_type, None), pos, None
+            name, pos = name + match.group(), match.end()
+
+    pos += 1
+    next_ = vars_[pos : pos + 1] if pos < end else empty
+    if next_ == bang:
+        indirect, pos = True, pos + 1
+    elif next_ == hash_:
+        modifier_type, pos = ModifierType.LENGTH, pos + 1
+
+    # ${VAR}
+    while True:
+        next_ = vars_[pos : pos + 1] if pos < end else empty
+        if not next_:
+            raise _unclosed(vars_, start, name, partial)
+        elif next_ == rbrace:
+            return _Var(name, indirect, modifier_type, None), pos + 1, None
+        elif next_ == var_symbol and not name:
+            name, pos = var_symbol, pos + 1
+        else:
+            match = name_re.match(vars_, pos, end)
+            if match is None:
+                break
+            name, pos = name + match.group(), match.end()
+
+    # ${VAR:...}, ${VAR-...} etc.
+    colon = next_ == colon_
+    if colon:
+        pos += 1
+        next_ = vars_[pos : pos + 1] if pos < end else empty
+        if not next_:
+            raise _unclosed(vars_, start, name, partial)
+
+    if colon and modifier_type is not None:
+        # ${#VAR:...}
+        return _Var(name, indirect, modifier_type, ()), pos, pos
+
+    if next_ == minus:
+        modifier_type = ModifierType.GET_DEFAULT
+    elif next_ == equals:
+        modifier_type = ModifierType.GET_OR_SET_DEFAULT
+    elif next_ == plus:
+        modifier_type = ModifierType.SUBSTITUTE
+    elif next_ == question:
+        modifier_type = ModifierType.STRICT
+    elif next_ == rbrace:
+        return _Var(name, indirect, ModifierType.OFFSET, ()), pos, pos
+    elif (
+        not colon
+        and modifier_type is None
+        and next_ in (hash_, percent, slash, caret, comma)
+    ):
+        # ${VAR#pattern}, ${VAR//pattern/string}, ${VAR^^} etc.
+        following = vars_[pos + 1 : pos + 2] if pos + 1 < end else empty
+        # Slices of a bytearray can't be hashed.
+        single, double = _PATTERN_MODIFIERS[
+            next_ if isinstance(next_, str) else bytes(next_)
+        ]
+        if following == next_:
+            modifier_type, pos = double, pos + 2
+        elif next_ == slash and following == hash_:
+            modifier_type, pos = ModifierType.REPLACE_PREFIX, pos + 2
+        elif next_ == slash and following == percent:
+            modifier_type, pos = ModifierType.REPLACE_SUFFIX, pos + 2
+        else:
+            modifier_type, pos = single, pos + 1
+        return _Var(name, indirect, modifier_type, ()), pos, pos
+    else:
+        # The first character of an offset is part of it, but never closes
+        # or opens a pair of braces.
+        return _Var(name, indirect, ModifierType.OFFSET, ()), pos, pos + 1
 
-        elif state == State.READING_MODIFIER_VAR or (
-            state == State.READING_MODIFIER and modifier_type is None
-        ):
-            state = State.READING_MODIFIER
-            modifier, modifier_type = [], None
-            if next_ == "-":
-                modifier_type = ModifierType.GET_DEFAULT
-            elif next_ == "=":
-                modifier_type = ModifierType.GET_OR_SET_DEFAULT
-            elif next_ == "+":
-                modifier_type = ModifierType.SUBSTITUTE
-            elif next_ == "?":
-                modifier_type = ModifierType.STRICT
-            elif next_ == "}":
-                modifier_type = ModifierType.OFFSET
-                state = State.FINISHED_READING
-            else:
-                modifier_type = ModifierType.OFFSET
-                modifier.append(next_)
-            next(buff)
-
-        elif state == State.READING_MODIFIER:
-            c = next(buff)
-            if c == "{":
-                bracedepth += 1
-                modifier.append(c)
-            elif c == "}":
-                if bracedepth == 0:
-                    state = State.FINISHED_READING
-                else:
-                    modifier.append(c)
-                    bracedepth -= 1
-            else:
-                modifier.append(c)
+    return _Var(name, indirect, modifier_type, ()), pos + 1, pos + 1
 
-        elif state == State.READING_VAR:
-            state = State.FINISHED_READING
 
+def _unclosed(vars_, index, name, partial):
+    """The error for the variable at index, whose closing brace is missing."""
+    if partial:
+        return _Incomplete()
+    return _syntax_error(MissingClosingBrace, vars_, index, _latin1(name))
+
+
+def _find_closing_brace(vars_, pos, end, braces, brace_re):
+    """Find the first closing brace after pos that isn't part of a pair.
+
+    The pairs found on the way are recorded in braces, which map the position
+    of an opening brace to the one of its closing brace, so that the nested
+    expressions then jump over the pairs they contain instead of scanning
+    them again. Only the text up to the closing brace is scanned.
+    """
+    opened = []
+    while True:
+        match = brace_re.search(vars_, pos, end)
+        if match is None:
+            return None
+        index = match.start()
+        pos = index + 1
+        if match.lastindex:
+            close = braces.get(index)
+            if close is None:
+                opened.append(index)
+            else:
+                pos = close + 1
+        elif opened:
+            braces[opened.pop()] = index
         else:
-            # This should never happen
-            raise ExpandvarsException("unexpected state")  # pragma: no cover
+            return index
+
+
+def _set_operand(node, operand):
+    node.operand = operand
+
+    if node.modifier_type in _REPLACE_MODIFIERS:
+        node.operand, node.split = _split_replacement(operand)
+    elif node.modifier_type == ModifierType.OFFSET and all(
+        type(n) is not _Var for n in operand
+    ):
+        # Nothing to expand, so the offset and length can be computed once.
+        # Invalid expressions are left alone to fail while rendering. There
+        # is at most one literal, since consecutive ones are joined.
+        try:
+            node.offset, node.length = _parse_offset(
+                node.name, _latin1(operand[0]) if operand else ""
+            )
+            node.operand = None
+        except ExpandvarsException:
+            pass
+
+
+def _split_replacement(operand):
+    """Split the operand of ${VAR/pattern/string} at the first unescaped slash.
+
+    Returns:
+        tuple: The nodes without the slash, and the number of nodes of the pattern.
+    """
+    for index, node in enumerate(operand):
+        if type(node) is _Var:
+            continue
+
+        slash, backslash = ("/", "\\") if isinstance(node, str) else (b"/", b"\\")
+        pos = node.find(slash)
+        while pos != -1:
+            before = node[:pos]
+            if (len(before) - len(before.rstrip(backslash))) % 2 == 0:
+                after = node[pos + 1 :]
+                pattern = operand[:index] + ((before,) if before else ())
+                string = ((after,) if after else ()) + operand[index + 1 :]
+                return pattern + string, len(pattern)
+            pos = node.find(slash, pos + 1)
+
+    return operand, len(operand)
+
+
+def _latin1(text):
+    """Decode bytes-like text from latin-1, which maps each byte to a character."""
+    if isinstance(text, str):
+        return text
+    return bytes(text).decode("latin-1")
+
+
+def _iter_vars(nodes):
+    """Iterate over all the _Var nodes, including the ones in operands."""
+    stack = [nodes]
+    while stack:
+        for node in stack.pop():
+            if type(node) is _Var:
+                yield node
+                if node.operand:
+                    stack.append(node.operand)
+
+
+def _render(nodes, nounset, environ, var_symbol, modify=None, binary=False):
+    """Render the nodes, with an explicit stack instead of recursing in operands.
+
+    Like in bash, operands are only rendered when they are used, e.g. the
+    default in ${VAR:-default} when VAR is null or unset. They are rendered
+    with nounset=False.
+
+    The modifiers are applied with modify, _modify() by default. If binary is
+    True, the literals are bytes, while the values in environ are decoded
+    from latin-1, see _BytesEnviron.
+    """
+    if modify is None:
+        modify = _modify
+
+    empty = ""
+    if binary:
+        empty, modify = b"", partial(_modify_binary, modify)
+
+    stack = []
+    buff, index = [], 0
+    try:
+        while True:
+            if index < len(nodes):
+                node = nodes[index]
+                index += 1
+                if type(node) is not _Var:
+                    buff.append(node)
+                    continue
+
+                val = getenv(
+                    node.name,
+                    indirect=node.indirect,
+                    environ=environ,
+                    var_symbol=var_symbol,
+                )
+                if node.operand is None or not _uses_operand(node.modifier_type, val):
+                    buff.append(modify(node, val, None, nounset and not stack, environ))
+                else:
+                    # Render the operand first, then come back to this node.
+                    stack.append((nodes, index, buff, node, val))
+                    nodes, index, buff = node.operand, 0, []
+                continue
+
+            if not stack:
+                return empty.join(buff)
+
+            operand = buff
+            nodes, index, buff, node, val = stack.pop()
+            if node.split is None:
+                modifier = empty.join(operand)
+            else:
+                # Each node of the operand rendered to one item.
+                split = node.split
+                modifier = empty.join(operand[:split]), empty.join(operand[split:])
+            buff.append(modify(node, val, modifier, nounset and not stack, environ))
+    except ExpandvarsException as e:
+        # Record which variable failed, Template.render() adds the line.
+        e.position, e.var = node.position, node.name
+        raise
+
+
+def _modify_binary(modify, node, val, modifier, nounset, environ):
+    """Apply modify to the operand decoded from latin-1, and encode the result."""
+    if type(modifier) is tuple:
+        modifier = tuple(m.decode("latin-1") for m in modifier)
+    elif modifier is not None:
+        modifier = modifier.decode("latin-1")
+
+    if node.modifier_type in _CASE_MODIFIERS and val is not None:
+        # Only the case of ASCII letters is converted, as the other bytes may
+        # be part of multibyte characters, e.g. in UTF-8.
+        modified = _modify_pattern(node.modifier_type, val, modifier, ascii_only=True)
+    else:
+        modified = modify(node, val, modifier, nounset, environ)
+    return modified.encode("latin-1")
 
-    var = "".join(name)
-    return var, modifier_type, modifier, indirect
 
+def _uses_operand(modifier_type, val):
+    if modifier_type == ModifierType.SUBSTITUTE:
+        return bool(val)
+    elif modifier_type in _DEFAULT_MODIFIERS:
+        return not val
+    return True
 
-def _expand_var(buff, nounset, environ, var_symbol):
-    var, modifier_type, modifier, indirect = _read_var(buff, var_symbol=var_symbol)
-    if not var:
-        raise BadSubstitution("")
 
-    val = getenv(var, indirect=indirect, environ=environ, var_symbol=var_symbol)
-    modifier = expand("".join(modifier), environ=environ, var_symbol=var_symbol)
+def _modify(node, val, modifier, nounset, environ):
+    """Apply the modifier of the node to the value of its variable."""
+    var, modifier_type = node.name, node.modifier_type
 
     if modifier_type == ModifierType.LENGTH:
         if modifier:
@@ -329,11 +2582,21 @@ def _expand_var(buff, nounset, environ, var_symbol):
         modified = modifier if val else ""
 
     elif modifier_type == ModifierType.OFFSET:
-        modified = _modify_offset(var, val, modifier)
+        if modifier is None:
+            offset, length = node.offset, node.length
+        else:
+            offset, length = _parse_offset(var, modifier)
+        width = offset + length if length is not None else None
+        modified = (val or "")[offset:width]
 
     elif modifier_type == ModifierType.STRICT:
         modified = _modify_strict(var, val, modifier, environ=environ)
 
+    elif modifier_type in _PATTERN_MODIFIER_TYPES:
+        modified = (
+            None if val is None else _modify_pattern(modifier_type, val, modifier)
+        )
+
     else:
         modified = val
 
@@ -358,7 +2621,7 @@ def _modify_get_or_set_default(var, val, modifier, environ):
         return modifier
 
 
-def _modify_offset(var, val, modifier):
+def _parse_offset(var, modifier):
     if not modifier:
         raise BadSubstitution(var)
 
@@ -388,8 +2651,7 @@ def _modify_offset(var, val, modifier):
         if length < 0:
             raise NegativeSubStringExpression(var, length_str)
 
-    width = offset + length if length is not None else None
-    return (val or "")[offset:width]
+    return offset, length
 
 
 def _modify_strict(var, val, modifier, environ):
@@ -402,8 +2664,136 @@ def _modify_strict(var, val, modifier, environ):
     raise ParameterNullOrNotSet(var, modifier if modifier else None)
 
 
-def _valid_char(char):
-    return char.isalnum() or char == "_"
+def _modify_pattern(modifier_type, val, modifier, ascii_only=False):
+    """Apply a pattern operator, e.g. ${VAR%pattern}, like bash does.
+
+    If ascii_only is True, only the case of ASCII letters is converted.
+    """
+    if modifier_type in _REPLACE_MODIFIERS:
+        pattern, string = modifier
+    else:
+        pattern = modifier
+
+    if modifier_type == ModifierType.REMOVE_PREFIX:
+        match = _glob_re(pattern, False, False).match(val)
+        return val[match.end() :] if match else val
+
+    elif modifier_type == ModifierType.REMOVE_LONGEST_PREFIX:
+        match = _glob_re(pattern, True, False).match(val)
+        return val[match.end() :] if match else val
+
+    elif modifier_type == ModifierType.REMOVE_SUFFIX:
+        match = _glob_re(pattern, False, True).match(val[::-1])
+        return val[: len(val) - match.end()] if match else val
+
+    elif modifier_type == ModifierType.REMOVE_LONGEST_SUFFIX:
+        match = _glob_re(pattern, True, True).match(val[::-1])
+        return val[: len(val) - match.end()] if match else val
+
+    elif modifier_type == ModifierType.REPLACE:
+        # The longest match, starting as early as possible.
+        match = _glob_re(pattern, True, False).search(val) if pattern else None
+        if not match or not match.group():
+            return val
+        return val[: match.start()] + string + val[match.end() :]
+
+    elif modifier_type == ModifierType.REPLACE_ALL:
+        if not pattern:
+            return val
+        return _glob_re(pattern, True, False).sub(
+            lambda match: string if match.group() else "", val
+        )
+
+    elif modifier_type == ModifierType.REPLACE_PREFIX:
+        match = _glob_re(pattern, True, False).match(val)
+        return string + val[match.end() :] if match else val
+
+    elif modifier_type == ModifierType.REPLACE_SUFFIX:
+        match = _glob_re(pattern, True, True).match(val[::-1])
+        return val[: len(val) - match.end()] + string if match else val
+
+    elif modifier_type in (ModifierType.UPPERCASE_FIRST, ModifierType.UPPERCASE):
+        return _convert_case(
+            val, str.upper, pattern, modifier_type == ModifierType.UPPERCASE, ascii_only
+        )
+
+    else:
+        return _convert_case(
+            val, str.lower, pattern, modifier_type == ModifierType.LOWERCASE, ascii_only
+        )
+
+
+def _convert_case(val, convert, pattern, all_, ascii_only=False):
+    """Convert the case of the first character, or all, matching pattern.
+
+    Like in bash, each character is converted to exactly one, e.g. "ß" stays
+    "ß", and characters of latin-1 are kept in latin-1. If ascii_only is
+    True, the other characters are left as they are.
+    """
+    if not all_:
+        return _convert_case(val[:1], convert, pattern, True, ascii_only) + val[1:]
+    elif not pattern and val.isascii():
+        return convert(val)
+
+    char_re = _glob_re(pattern or "?", True, False)
+    chars = []
+    for char in val:
+        if ascii_only and not char.isascii():
+            chars.append(char)
+            continue
+        converted = convert(char)
+        if (
+            len(converted) == 1
+            and (ord(converted) < 256 or ord(char) >= 256)
+            and char_re.fullmatch(char)
+        ):
+            char = converted
+        chars.append(char)
+    return "".join(chars)
+
+
+@_cached(maxsize=256)
+def _glob_re(pattern, longest, reverse):
+    """Translate a bash pattern to a regular expression.
+
+    The patterns matching the end of the values are applied to the reversed
+    values, so they are reversed too. Cached, since the same patterns are
+    used every time a template is rendered.
+
+    Params:
+        pattern (str): The pattern, where * matches any string, ? any character, [...] any character of the set, and \\ escapes the next character.
+        longest (bool): Whether * matches as much as possible, or as little.
+        reverse (bool): Whether to match the reversed pattern.
+    """
+    atoms, pos, end = [], 0, len(pattern)
+    while pos < end:
+        char = pattern[pos]
+        pos += 1
+        if char == "*":
+            atoms.append(".*" if longest else ".*?")
+        elif char == "?":
+            atoms.append(".")
+        elif char == "\\" and pos < end:
+            atoms.append(re.escape(pattern[pos]))
+            pos += 1
+        elif char == "[":
+            # A ] right after [, [! or [^ is part of the set.
+            start = pos + 1 if pattern[pos : pos + 1] in ("!", "^") else pos
+            close = pattern.find("]", start + 1)
+            if close == -1:
+                atoms.append(re.escape(char))
+                continue
+            chars = "".join(
+                "-" if c == "-" else re.escape(c) for c in pattern[start:close]
+            )
+            atoms.append("[{0}{1}]".format("^" if start > pos else "", chars))
+            pos = close + 1
+        else:
+            atoms.append(re.escape(char))
+
+    if reverse:
+        atoms.reverse()
+    return re.compile("".join(atoms), re.DOTALL)
 
 
 def _isint(val):
@@ -414,28 +2804,174 @@ def _isint(val):
         return False
 
 
-class _PeekableIterator:
-    """Peekable iterator."""
+def main(argv=None):
+    """Expand the files given on the command line, or stdin, to stdout.
 
-    NOTHING = object()
+    This is the entry point of `python -m expandvars` and of the expandvars
+    command. The text is read and written chunk by chunk, so the memory used
+    doesn't grow with the size of the input. Stdin is read line by line, and
+    each line is written as soon as it is expanded.
 
-    def __init__(self, iterable):
-        self.iterator = iter(iterable)
-        self._next = self.NOTHING
+    Params:
+        argv (list): The arguments, without the program name. Defaults to sys.argv[1:].
 
-    def __iter__(self):
-        return self
+    Returns:
+        int: The exit status, 0 on success.
 
-    def __next__(self):
-        if self._next is self.NOTHING:
-            return next(self.iterator)
-        else:
-            next_ = self._next
-            self._next = self.NOTHING
-            return next_
-
-    def peek(self):
-        """Peek at the next item."""
-        if self._next is self.NOTHING:
-            self._next = next(self.iterator, self.NOTHING)
-        return self._next
+    Example usage: ::
+
+        $ echo 'Hello ${NAME:-world}' | python -m expandvars
+        Hello world
+
+        $ expandvars --env-file prod.env --out-dir /etc/myapp --jobs 4 *.conf
+    """
+    # Imported here as it is only needed by the command line.
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        prog="expandvars", description=__description__ + "."
+    )
+    parser.add_argument(
+        "files",
+        nargs="*",
+        metavar="FILE",
+        help="files to expand, to stdout unless --in-place or --out-dir is "
+        "given. Reads stdin when none is given, or for -",
+    )
+    output = parser.add_mutually_exclusive_group()
+    output.add_argument(
+        "-i", "--in-place", action="store_true", help="overwrite the files"
+    )
+    output.add_argument(
+        "-o",
+        "--out-dir",
+        metavar="DIR",
+        help="write the files under the same name in DIR",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        metavar="N",
+        help="number of files expanded in parallel with --in-place or "
+        "--out-dir. Defaults to the number of CPUs",
+    )
+    parser.add_argument(
+        "-e",
+        "--env-file",
+        action="append",
+        default=[],
+        metavar="FILE",
+        help="read variables from FILE, in NAME=value lines, overriding the "
+        "environment. Can be repeated",
+    )
+    parser.add_argument(
+        "-u",
+        "--nounset",
+        action="store_true",
+        help="fail on unset variables, like set -u in bash",
+    )
+    parser.add_argument(
+        "--var-symbol",
+        default=VAR_SYMBOL,
+        metavar="SYMBOL",
+        help="character used to identify a variable. Defaults to $",
+    )
+    parser.add_argument(
+        "--surrounded-vars-only",
+        action="store_true",
+        help="only expand the variables in braces, like ${VAR}",
+    )
+    parser.add_argument(
+        "--version", action="version", version="%(prog)s " + __version__
+    )
+    args = parser.parse_args(argv)
+
+    environ = os.environ
+    if args.env_file:
+        variables = {}
+        try:
+            for path in args.env_file:
+                variables.update(_read_env_file(path))
+        except (OSError, ValueError) as e:
+            parser.error(str(e))
+        environ = ChainMap(variables, os.environ)
+
+    options = dict(
+        nounset=args.nounset,
+        environ=environ,
+        var_symbol=args.var_symbol,
+        surrounded_vars_only=args.surrounded_vars_only,
+    )
+
+    if args.in_place or args.out_dir is not None:
+        if not args.files or "-" in args.files:
+            parser.error("stdin can't be expanded with --in-place or --out-dir")
+        if args.out_dir is not None:
+            try:
+                os.makedirs(args.out_dir, exist_ok=True)
+            except OSError as e:
+                parser.error("can't create {0}: {1}".format(args.out_dir, e))
+        try:
+            errors = expand_files(
+                args.files, out_dir=args.out_dir, workers=args.jobs, **options
+            )
+        except ValueError as e:
+            parser.error(str(e))
+        for path, error in errors.items():
+            print("expandvars: {0}: {1}".format(path, error), file=sys.stderr)
+        return 1 if errors else 0
+
+    status = 0
+    for path in args.files or ["-"]:
+        try:
+            if path == "-":
+                # Line by line, so that the output of a pipe that stays open,
+                # e.g. tail -f, is written as it comes.
+                lines = iter(sys.stdin.readline, "")
+                _write_expanded(lines, sys.stdout, options, flush=True)
+            else:
+                # Like stdin, without translating the newlines.
+                with open(path, newline="") as f:
+                    _write_expanded(f, sys.stdout, options)
+        except (OSError, ExpandvarsException) as e:
+            print("expandvars: {0}: {1}".format(path, e), file=sys.stderr)
+            status = 1
+    return status
+
+
+def _write_expanded(stream, out, options, flush=False):
+    for chunk in expand_stream(stream, **options):
+        out.write(chunk)
+        if flush:
+            out.flush()
+    out.flush()
+
+
+def _read_env_file(path):
+    """Read the NAME=value lines of an env file, as written for docker or systemd.
+
+    Blank lines and comments are skipped, an export prefix is allowed, and
+    the values may be quoted. They are not expanded.
+    """
+    variables = {}
+    with open(path) as f:
+        for lineno, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            if line.startswith("export "):
+                line = line[len("export ") :].lstrip()
+
+            name, sep, value = line.partition("=")
+            name, value = name.strip(), value.strip()
+            if not sep or not _TEXT_SYNTAX.name_re.fullmatch(name):
+                raise ValueError("{0}:{1}: invalid line".format(path, lineno))
+            if len(value) >= 2 and value[0] == value[-1] and value[0] in "'\"":
+                value = value[1:-1]
+            variables[name] = value
+    return variables
+
+
+if __name__ == "__main__":
+    sys.exit(main())
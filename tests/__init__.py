@@ -0,0 +1,13 @@
+# -*- coding: utf-8 -*-
+
+
+class RecordingEnviron(dict):
+    """A dict recording the names looked up with get() in lookups."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.lookups = []
+
+    def get(self, name, default=None):
+        self.lookups.append(name)
+        return super().get(name, default)
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+from os import getpid
+
+import pytest
+
+import expandvars
+
+
+class FakeStore:
+    """An asynchronous store, where each lookup is a round trip."""
+
+    def __init__(self, **values):
+        self.values = values
+        self.lookups = []
+        self.running = self.max_running = 0
+
+    async def get(self, name):
+        self.lookups.append(name)
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        await asyncio.sleep(0.01)
+        self.running -= 1
+        return self.values.get(name)
+
+
+def aexpand(*args, **kwargs):
+    return asyncio.run(expandvars.aexpand(*args, **kwargs))
+
+
+def test_aexpand():
+    store = FakeStore(USER="admin", PASSWORD="secret", HOST="db")
+    template = "postgres://$USER:${PASSWORD}@${HOST:-localhost}:${PORT:-5432}/$USER"
+
+    assert aexpand(template, store) == "postgres://admin:secret@db:5432/admin"
+    assert sorted(store.lookups) == ["HOST", "PASSWORD", "PORT", "USER"]
+    assert store.max_running == 4
+
+
+def test_aexpand_concurrency():
+    store = FakeStore()
+
+    assert aexpand("$A$B$C$D$E", store, concurrency=2) == ""
+    assert len(store.lookups) == 5
+    assert store.max_running == 2
+
+
+def test_aexpand_indirect():
+    store = FakeStore(REF="TARGET", TARGET="value", SELF="REF", PID="$")
+
+    assert aexpand("${!REF}", store) == "value"
+    assert store.lookups == ["REF", "TARGET"]
+
+    store.lookups = []
+    assert aexpand("${!REF}:${!SELF}:$TARGET", store) == "value:TARGET:value"
+    assert sorted(store.lookups) == ["REF", "SELF", "TARGET"]
+
+    assert aexpand("${!PID}", store) == str(getpid())
+
+    with pytest.raises(expandvars.InvalidIndirectExpansion):
+        aexpand("${!MISSING}", store)
+
+
+def test_aexpand_assignments():
+    store = FakeStore()
+
+    assert aexpand("${FOO:=foo}:$FOO", store) == "foo:foo"
+    assert store.values == {}
+
+
+def test_aexpand_strict():
+    store = FakeStore(EXPANDVARS_RECOVER_NULL="null")
+
+    assert aexpand("$FOO:${BAR:?}", store, nounset=True) == "null:null"
+
+    with pytest.raises(expandvars.UnboundVariable):
+        aexpand("$FOO", FakeStore(), nounset=True)
+    with pytest.raises(expandvars.ParameterNullOrNotSet):
+        aexpand("${FOO:?}", FakeStore())
+
+
+def test_aexpand_options():
+    store = FakeStore(FOO="foo")
+
+    assert aexpand("%{FOO}%FOO", store, var_symbol="%") == "foofoo"
+    assert aexpand("${FOO}$FOO", store, surrounded_vars_only=True) == "foo$FOO"
+
+    plain = "".join(["/usr", "/bin"])
+    assert aexpand(plain, store) is plain
+    assert store.lookups == ["FOO", "FOO"]
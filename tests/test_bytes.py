@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+
+import importlib
+import mmap
+import os
+from os import getpid
+from unittest.mock import patch
+
+import pytest
+
+import expandvars
+
+
+def test_expand_bytes():
+    environ = {b"FOO": b"foo\xff", b"REF": b"FOO", b"EMPTY": b""}
+
+    assert expandvars.expand(b"$FOO:${BAR:-b\xe9r}", environ=environ) == (
+        b"foo\xff:b\xe9r"
+    )
+    assert expandvars.expand(b"${#FOO}:${FOO:1:2}:${!REF}", environ=environ) == (
+        b"4:oo:foo\xff"
+    )
+    assert expandvars.expand(b"${EMPTY:+x}\\$FOO:$$", environ=environ) == (
+        "$FOO:{0}".format(getpid()).encode()
+    )
+    assert expandvars.expand(b"%FOO", environ=environ, var_symbol="%") == b"foo\xff"
+
+    expandvars.expand(b"${BAR:=bar}", environ=environ)
+    assert environ[b"BAR"] == b"bar"
+
+
+def test_expand_bytes_like():
+    environ = {b"FOO": b"foo"}
+
+    assert expandvars.expand(bytearray(b"${FOO}!"), environ=environ) == b"foo!"
+    assert expandvars.expand(memoryview(b"[$FOO]")[1:], environ=environ) == b"foo]"
+    assert expandvars.expand(memoryview(b"$$"), environ=environ) == (
+        str(getpid()).encode()
+    )
+
+    plain = b"no variables"
+    assert expandvars.expand(plain) is plain
+    assert expandvars.expand(bytearray(plain)) == plain
+    assert expandvars.expand(b"$", var_symbol="%%") == b"$"
+
+
+def test_expand_mmap(tmp_path):
+    path = tmp_path / "config.ini"
+    path.write_bytes(b"host = ${HOST:-localhost}\n" * 1000)
+
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+        template = expandvars.compile(m)
+        assert template.render(environ={b"HOST": b"db"}) == b"host = db\n" * 1000
+        assert expandvars.expand(m, environ={}) == b"host = localhost\n" * 1000
+
+
+def test_expand_bytes_defaults_to_environb(monkeypatch):
+    importlib.reload(expandvars)
+    # A stand-in, as there is no os.environb on Windows.
+    environb = {b"FOO": b"foo"}
+    monkeypatch.setattr(os, "supports_bytes_environ", True)
+    monkeypatch.setattr(os, "environb", environb, raising=False)
+
+    assert expandvars.expand(b"$FOO:${BAR:=bar}") == b"foo:bar"
+    assert environb == {b"FOO": b"foo", b"BAR": b"bar"}
+
+
+@patch.dict(os.environ, {"FOO": "f\xe9\xf6"}, clear=True)
+def test_expand_bytes_without_environb(monkeypatch):
+    # Like on Windows, where os.environ only has text names and values.
+    monkeypatch.setattr(os, "supports_bytes_environ", False)
+    encoded = os.fsencode("f\xe9\xf6")
+
+    assert expandvars.expand(b"$FOO:${BAR:=b\xc3\xa0r}") == encoded + b":b\xc3\xa0r"
+    assert os.environ["BAR"] == os.fsdecode(b"b\xc3\xa0r")
+
+
+def test_expand_bytes_stats():
+    stats = expandvars.Stats()
+
+    assert expandvars.expand(b"${FOO:-foo}", environ={}, stats=stats) == b"foo"
+    assert expandvars.expand(b"foo", environ={}, stats=stats) == b"foo"
+    assert (stats.expansions, stats.chars, stats.defaults) == (2, 14, 1)
+
+
+def test_expand_bytes_errors():
+    with pytest.raises(expandvars.MissingClosingBrace) as e:
+        expandvars.expand(b"foo\n${F\xc3\xa9:-x", environ={})
+    assert str(e.value) == "foo\n${Fé:-x: missing '}'"
+    assert (e.value.position, e.value.line, e.value.column) == (4, 2, 1)
+    assert e.value.var == "F"
+
+    with pytest.raises(expandvars.MissingClosingBrace) as e:
+        expandvars.expand(b"${FOO" + b" " * 100, environ={})
+    assert str(e.value) == "${FOO" + " " * 75 + "...: missing '}'"
+
+    with pytest.raises(expandvars.MissingClosingBrace) as e:
+        expandvars.expand(b" " * 100 + b"\n${FOO", environ={})
+    assert str(e.value) == "...${FOO: missing '}'"
+    assert (e.value.line, e.value.column) == (2, 1)
+
+    with pytest.raises(expandvars.ParameterNullOrNotSet) as e:
+        expandvars.expand(b"${FOO:?not set}", environ={})
+    assert str(e.value) == "'FOO: not set'"
+
+    with pytest.raises(expandvars.BadSubstitution) as e:
+        expandvars.expand(memoryview(b"${#FOO:x}"), environ={})
+    assert str(e.value) == "${#FOO:x}: bad substitution"
+
+
+def test_referenced_vars_bytes():
+    assert expandvars.referenced_vars(b"$FOO ${BAR:-$BAZ}").names == {
+        "FOO",
+        "BAR",
+        "BAZ",
+    }
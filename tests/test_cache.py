@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+
+import importlib
+from os import environ as env
+from unittest.mock import patch
+
+import expandvars
+
+
+@patch.dict(env, {"FOO": "foo"}, clear=True)
+def test_cache_hits():
+    importlib.reload(expandvars)
+
+    assert expandvars.cache_info().currsize == 0
+
+    assert expandvars.expandvars("$FOO") == "foo"
+    assert expandvars.expandvars("$FOO") == "foo"
+    assert expandvars.expand("$FOO", environ={"FOO": "bar"}) == "bar"
+
+    info = expandvars.cache_info()
+    assert (info.hits, info.misses, info.currsize) == (2, 1, 1)
+    assert info.maxsize == expandvars.CACHE_MAXSIZE
+
+
+def test_cache_key_includes_options():
+    importlib.reload(expandvars)
+
+    assert expandvars.expand("%FOO", environ={"FOO": "foo"}) == "%FOO"
+    assert expandvars.expand("%FOO", environ={"FOO": "foo"}, var_symbol="%") == "foo"
+    assert (
+        expandvars.expand(
+            "%FOO", environ={"FOO": "foo"}, var_symbol="%", surrounded_vars_only=True
+        )
+        == "%FOO"
+    )
+    assert expandvars.expand("\\$FOO", environ={"FOO": "foo"}) == "$FOO"
+    assert expandvars.expand("\\$FOO", environ={"FOO": "foo"}, escape_char="") == (
+        "\\foo"
+    )
+
+    # "%FOO" has nothing to expand with the default var_symbol.
+    assert expandvars.cache_info().currsize == 4
+
+
+def test_cache_eviction():
+    importlib.reload(expandvars)
+    expandvars.set_cache_maxsize(2)
+
+    for s in ["$A", "$B", "$A", "$C", "$B"]:
+        expandvars.expand(s, environ={})
+
+    info = expandvars.cache_info()
+    assert (info.hits, info.misses, info.maxsize, info.currsize) == (1, 4, 2, 2)
+
+
+def test_cache_disabled():
+    importlib.reload(expandvars)
+    expandvars.set_cache_maxsize(0)
+
+    assert expandvars.expand("$FOO", environ={"FOO": "foo"}) == "foo"
+    assert expandvars.expand("$FOO", environ={"FOO": "foo"}) == "foo"
+    assert expandvars.cache_info().currsize == 0
+
+    # Like with lru_cache, negative sizes disable it too.
+    expandvars.set_cache_maxsize(-1)
+    assert expandvars.expand("$FOO", environ={"FOO": "foo"}) == "foo"
+    assert expandvars.cache_info() == (0, 1, 0, 0)
+
+    expandvars.set_cache_maxsize()
+    assert expandvars.cache_info().maxsize == expandvars.CACHE_MAXSIZE
+
+
+def test_cache_clear():
+    importlib.reload(expandvars)
+
+    expandvars.expand("$FOO", environ={})
+    expandvars.cache_clear()
+
+    assert expandvars.cache_info().currsize == 0
+
+
+def test_cache_skips_long_strings():
+    importlib.reload(expandvars)
+
+    long_string = "$FOO" * 2000
+    assert expandvars.expand(long_string, environ={"FOO": "f"}) == "f" * 2000
+    assert expandvars.cache_info().currsize == 0
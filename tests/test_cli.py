@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+
+import io
+import runpy
+import sys
+
+import pytest
+
+import expandvars
+
+
+@pytest.fixture
+def stdin(monkeypatch):
+    def set_stdin(text):
+        monkeypatch.setattr(sys, "stdin", io.StringIO(text))
+
+    return set_stdin
+
+
+@pytest.fixture(autouse=True)
+def environ(monkeypatch):
+    monkeypatch.setenv("FOO", "foo")
+    monkeypatch.delenv("BAR", raising=False)
+
+
+def test_cli_stdin(stdin, capsys):
+    stdin("$FOO:${BAR:-bar}\n")
+
+    assert expandvars.main([]) == 0
+    assert capsys.readouterr().out == "foo:bar\n"
+
+
+def test_cli_stdin_line_by_line(monkeypatch):
+    class Stdin:
+        # No read(), which would block until it gets all the characters asked.
+        def __init__(self, lines):
+            self.lines = iter(lines)
+
+        def readline(self):
+            return next(self.lines)
+
+    class Stdout(io.StringIO):
+        def flush(self):
+            self.flushed.append(self.getvalue())
+
+    def lines():
+        yield "$FOO\n"
+        # The first line was written before the next one is read.
+        assert stdout.flushed[-1] == "foo\n"
+        yield "${BAR:-\n"
+        yield "bar}\n"
+        yield ""
+
+    stdout = Stdout()
+    stdout.flushed = []
+    monkeypatch.setattr(sys, "stdin", Stdin(lines()))
+    monkeypatch.setattr(sys, "stdout", stdout)
+
+    assert expandvars.main(["-"]) == 0
+    assert stdout.getvalue() == "foo\n\nbar\n"
+
+
+def test_cli_options(stdin, capsys):
+    stdin("%FOO:%{FOO}")
+    assert expandvars.main(["--var-symbol", "%", "--surrounded-vars-only"]) == 0
+    assert capsys.readouterr().out == "%FOO:foo"
+
+    stdin("$FOO:$BAR")
+    assert expandvars.main(["--nounset"]) == 1
+    captured = capsys.readouterr()
+    assert captured.out == "foo:"
+    assert captured.err == "expandvars: -: 'BAR: unbound variable'\n"
+
+
+def test_cli_files(tmp_path, stdin, capsys):
+    (tmp_path / "a.conf").write_text("a=$FOO\n")
+    (tmp_path / "b.conf").write_text("b=${BAR:-b}\n")
+    stdin("-=$FOO\n")
+
+    paths = [str(tmp_path / "a.conf"), "-", str(tmp_path / "b.conf")]
+    assert expandvars.main(paths + [str(tmp_path / "missing")]) == 1
+
+    captured = capsys.readouterr()
+    assert captured.out == "a=foo\n-=foo\nb=b\n"
+    assert captured.err.startswith("expandvars: {0}: ".format(tmp_path / "missing"))
+
+
+def test_cli_env_file(tmp_path, stdin, capsys):
+    env_file = tmp_path / "prod.env"
+    env_file.write_text(
+        "# Comment\n\nFOO=prod\nexport BAR = 'quoted value'\nBAZ=\"$FOO\"\n"
+    )
+    stdin("$FOO $BAR $BAZ")
+
+    assert expandvars.main(["--env-file", str(env_file)]) == 0
+    assert capsys.readouterr().out == "prod quoted value $FOO"
+
+    env_file.write_text("FOO=prod\nnot a variable\n")
+    with pytest.raises(SystemExit) as e:
+        expandvars.main(["-e", str(env_file)])
+    assert e.value.code == 2
+    assert "prod.env:2: invalid line" in capsys.readouterr().err
+
+    with pytest.raises(SystemExit):
+        expandvars.main(["-e", str(tmp_path / "missing.env")])
+
+
+@pytest.mark.parametrize("jobs", ["1", "2"])
+def test_cli_out_dir(tmp_path, capsys, jobs):
+    out_dir = tmp_path / "out"
+    out_dir.mkdir()
+    (tmp_path / "a.conf").write_text("a=$FOO\n")
+    (tmp_path / "b.conf").write_text("b=${BAR?}\n")
+
+    paths = [str(tmp_path / "a.conf"), str(tmp_path / "b.conf")]
+    assert expandvars.main(["--out-dir", str(out_dir), "--jobs", jobs] + paths) == 1
+
+    assert (out_dir / "a.conf").read_text() == "a=foo\n"
+    assert not (out_dir / "b.conf").exists()
+    assert capsys.readouterr().err == (
+        "expandvars: {0}: 'BAR: parameter null or not set'\n".format(paths[1])
+    )
+
+
+def test_cli_out_dir_missing(tmp_path, capsys):
+    (tmp_path / "a.conf").write_text("a=$FOO\n")
+    out_dir = tmp_path / "out" / "nested"
+
+    assert expandvars.main(["-o", str(out_dir), str(tmp_path / "a.conf")]) == 0
+    assert (out_dir / "a.conf").read_text() == "a=foo\n"
+
+    not_a_dir = tmp_path / "a.conf"
+    with pytest.raises(SystemExit) as e:
+        expandvars.main(["-o", str(not_a_dir / "out"), str(not_a_dir)])
+    assert e.value.code == 2
+    assert "can't create {0}".format(not_a_dir / "out") in capsys.readouterr().err
+
+
+def test_cli_in_place(tmp_path, capsys):
+    path = tmp_path / "a.conf"
+    path.write_text("a=$FOO\n")
+
+    assert expandvars.main(["-i", str(path)]) == 0
+    assert path.read_text() == "a=foo\n"
+    assert capsys.readouterr() == ("", "")
+
+    with pytest.raises(SystemExit):
+        expandvars.main(["-i"])
+    with pytest.raises(SystemExit):
+        expandvars.main(["-i", str(path), str(path)])
+
+
+def test_cli_keeps_line_endings(tmp_path, capsys):
+    path = tmp_path / "crlf.conf"
+    path.write_bytes(b"a=$FOO\r\nb=${BAR:-b}\r\n")
+
+    assert expandvars.main([str(path)]) == 0
+    assert capsys.readouterr().out == "a=foo\r\nb=b\r\n"
+
+    assert expandvars.main(["-i", str(path)]) == 0
+    assert path.read_bytes() == b"a=foo\r\nb=b\r\n"
+
+
+def test_cli_module(monkeypatch, stdin, capsys):
+    stdin("$FOO")
+    monkeypatch.setattr(sys, "argv", ["expandvars"])
+
+    with pytest.raises(SystemExit) as e:
+        runpy.run_module("expandvars", run_name="__main__")
+
+    assert e.value.code == 0
+    assert capsys.readouterr().out == "foo"
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+
+import importlib
+from os import environ as env
+from unittest.mock import patch
+
+import pytest
+
+import expandvars
+
+
+def test_compile_render_many_times():
+    template = expandvars.compile("$HOST:${PORT:-8080}")
+
+    assert template.render(environ={"HOST": "localhost"}) == "localhost:8080"
+    assert template.render(environ={"HOST": "example.com", "PORT": "80"}) == (
+        "example.com:80"
+    )
+    assert repr(template) == "Template('$HOST:${PORT:-8080}')"
+
+
+@patch.dict(env, {"FOO": "bar"}, clear=True)
+def test_compile_defaults_to_os_environ():
+    importlib.reload(expandvars)
+
+    template = expandvars.compile("${FOO}:${BAR:=baz}")
+
+    assert template.render() == "bar:baz"
+    assert env["BAR"] == "baz"
+
+
+@patch.dict(env, {"FOO": "bar"}, clear=True)
+def test_compile_from_file():
+    importlib.reload(expandvars)
+
+    with open("tests/data/foo.txt") as f:
+        template = expandvars.compile(f)
+
+    assert template.source == "$FOO:${FOO}\n"
+    assert template.render() == "bar:bar\n"
+
+
+def test_compile_options():
+    template = expandvars.compile(
+        "%{FOO}:%BAR:\\%{FOO}", var_symbol="%", surrounded_vars_only=True
+    )
+
+    assert template.var_symbol == "%"
+    assert template.surrounded_vars_only is True
+    assert template.escape_char == "\\"
+    assert template.render(environ={"FOO": "foo", "BAR": "bar"}) == "foo:%BAR:%{FOO}"
+
+
+def test_compile_offset():
+    template = expandvars.compile("${FOO:3:3}|${FOO:$OFFSET:$LEN}")
+
+    assert template.render(environ={"FOO": "foobar", "OFFSET": "1", "LEN": "2"}) == (
+        "bar|oo"
+    )
+    assert template.render(environ={"FOO": "abcdef", "OFFSET": "4", "LEN": "9"}) == (
+        "def|ef"
+    )
+
+
+def test_compile_syntax_errors():
+    with pytest.raises(expandvars.MissingClosingBrace) as e:
+        expandvars.compile("${FOO")
+    assert str(e.value) == "${FOO: missing '}'"
+
+    with pytest.raises(expandvars.MissingEscapedChar) as e:
+        expandvars.compile("FOO\\")
+    assert str(e.value) == "FOO\\: missing escaped character"
+
+    with pytest.raises(expandvars.BadSubstitution) as e:
+        expandvars.compile("${FOO:-${}}")
+    assert str(e.value) == "${FOO:-${}}: bad substitution"
+
+    with pytest.raises(expandvars.BadSubstitution) as e:
+        expandvars.compile("${:-default}")
+    assert str(e.value) == "${:-default}: bad substitution"
+
+
+def test_compile_without_special_chars():
+    template = expandvars.compile("$FOO\\", var_symbol="$$", escape_char=None)
+    assert template.render(environ={"FOO": "foo"}) == "$FOO\\"
+
+    assert expandvars.compile("", escape_char="").render(environ={}) == ""
+
+
+def test_render_errors():
+    template = expandvars.compile("${FOO:$RANGE}|${FOO:?}")
+
+    assert template.render(environ={"FOO": "foo", "RANGE": "1:1"}) == "o|foo"
+
+    with pytest.raises(expandvars.BadSubstitution) as e:
+        template.render(environ={"FOO": "foo", "RANGE": "1:1:1"})
+    assert str(e.value) == "${FOO:$RANGE}|${FOO:?}: bad substitution"
+
+    with pytest.raises(expandvars.ParameterNullOrNotSet):
+        template.render(environ={"RANGE": "1"})
+
+    with pytest.raises(expandvars.UnboundVariable):
+        expandvars.compile("$FOO").render(environ={}, nounset=True)
@@ -0,0 +1,261 @@
+# -*- coding: utf-8 -*-
+
+import os
+
+import pytest
+
+import expandvars
+
+TEMPLATE = (
+    "url=$HOST:${PORT:-${DEFAULT_PORT:=80}}/${PATH_PREFIX:1:3}\n"
+    "image=${IMAGE/:latest/:$TAG} ${IMAGE%%:*} ${#HOST} ${!REF} \\$ ${EMPTY:-}\n"
+)
+ENVIRON = {"HOST": "db", "IMAGE": "app:latest", "TAG": "v2", "REF": "HOST"}
+
+
+def write(path, text, mtime_ns=None):
+    path.write_text(text)
+    if mtime_ns is not None:
+        os.utime(path, ns=(mtime_ns, mtime_ns))
+    return str(path)
+
+
+def cache_files(cache_dir):
+    return sorted(p.name for p in cache_dir.iterdir())
+
+
+def test_compile_file(tmp_path):
+    path = write(tmp_path / "app.conf", TEMPLATE)
+    expected = expandvars.compile(TEMPLATE).render(environ=dict(ENVIRON))
+
+    template = expandvars.compile_file(path)
+    assert template.source == TEMPLATE
+    assert template.render(environ=dict(ENVIRON)) == expected
+    assert not (tmp_path / "cache").exists()
+
+
+def test_compile_file_cache(tmp_path, monkeypatch):
+    path = write(tmp_path / "app.conf", TEMPLATE)
+    cache_dir = tmp_path / "cache"
+
+    template = expandvars.compile_file(path, cache_dir=str(cache_dir))
+    expected = template.render(environ=dict(ENVIRON))
+    assert len(cache_files(cache_dir)) == 1
+
+    parsed = []
+    monkeypatch.setattr(expandvars, "_parse", lambda *args, **kw: parsed.append(args))
+
+    cached = expandvars.compile_file(path, cache_dir=str(cache_dir))
+    assert parsed == []
+    assert cached.source == TEMPLATE
+    assert cached.render(environ=dict(ENVIRON)) == expected
+    assert cached.referenced_vars() == template.referenced_vars()
+
+
+def test_compile_file_cache_errors_keep_their_location(tmp_path):
+    path = write(tmp_path / "app.conf", "line\n${HOST:?missing}")
+    cache_dir = str(tmp_path / "cache")
+
+    expandvars.compile_file(path, cache_dir=cache_dir)
+    template = expandvars.compile_file(path, cache_dir=cache_dir)
+
+    with pytest.raises(expandvars.ParameterNullOrNotSet) as e:
+        template.render(environ={})
+    assert (e.value.line, e.value.column, e.value.var) == (2, 1, "HOST")
+
+
+def test_compile_file_cache_invalidation(tmp_path):
+    cache_dir = str(tmp_path / "cache")
+    path = write(tmp_path / "app.conf", "$A", mtime_ns=10**18)
+
+    assert expandvars.compile_file(path, cache_dir=cache_dir).render({"A": "a"}) == "a"
+
+    # Same size and modification time, different content.
+    write(tmp_path / "app.conf", "$B", mtime_ns=10**18)
+    template = expandvars.compile_file(path, cache_dir=cache_dir)
+    assert template.render({"A": "a", "B": "b"}) == "b"
+
+    # Only touched.
+    write(tmp_path / "app.conf", "$B", mtime_ns=2 * 10**18)
+    template = expandvars.compile_file(path, cache_dir=cache_dir)
+    assert template.render({"B": "b"}) == "b"
+
+    write(tmp_path / "app.conf", "${B}")
+    template = expandvars.compile_file(path, cache_dir=cache_dir)
+    assert template.render({"B": "b"}) == "b"
+    assert len(cache_files(tmp_path / "cache")) == 1
+
+
+def test_compile_file_cache_options(tmp_path):
+    cache_dir = str(tmp_path / "cache")
+    path = write(tmp_path / "app.conf", "$A%A%{A}")
+    environ = {"A": "a"}
+
+    assert expandvars.compile_file(path, cache_dir=cache_dir).render(environ) == (
+        "a%A%{A}"
+    )
+    template = expandvars.compile_file(path, var_symbol="%", cache_dir=cache_dir)
+    assert template.render(environ) == "$Aaa"
+    template = expandvars.compile_file(
+        path, var_symbol="%", surrounded_vars_only=True, cache_dir=cache_dir
+    )
+    assert template.render(environ) == "$A%Aa"
+    assert (template.var_symbol, template.surrounded_vars_only) == ("%", True)
+    assert len(cache_files(tmp_path / "cache")) == 3
+
+    template = expandvars.compile_file(path, var_symbol="%", cache_dir=cache_dir)
+    assert template.render(environ) == "$Aaa"
+
+
+def test_compile_file_cache_deep_nesting(tmp_path):
+    nested = "${A:-" * 900 + "x" + "}" * 900
+    path = write(tmp_path / "nested.conf", nested)
+    cache_dir = str(tmp_path / "cache")
+
+    expandvars.compile_file(path, cache_dir=cache_dir)
+    template = expandvars.compile_file(path, cache_dir=cache_dir)
+    assert template.render(environ={}) == "x"
+    assert template.render(environ={"A": "a"}) == "a"
+
+
+def test_compile_file_cache_size(tmp_path):
+    cache_dir = tmp_path / "cache"
+    paths = [write(tmp_path / "{0}.conf".format(i), "$A" * 100) for i in range(4)]
+
+    expandvars.compile_file(paths[0], cache_dir=str(cache_dir))
+    (entry,) = cache_dir.iterdir()
+    size = entry.stat().st_size
+
+    for i, path in enumerate(paths[1:]):
+        os.utime(entry, ns=(i, i))
+        entry = None
+        expandvars.compile_file(path, cache_dir=str(cache_dir), cache_size=size * 2)
+        entries = list(cache_dir.iterdir())
+        assert len(entries) <= 2
+        entry = max(entries, key=lambda e: e.stat().st_mtime_ns)
+
+    assert len(cache_files(cache_dir)) == 2
+
+    expandvars.compile_file(paths[0], cache_dir=str(cache_dir), cache_size=0)
+    assert cache_files(cache_dir) == []
+
+
+def test_compile_file_cache_corrupted(tmp_path):
+    cache_dir = tmp_path / "cache"
+    path = write(tmp_path / "app.conf", "${A:-a}")
+
+    expandvars.compile_file(path, cache_dir=str(cache_dir))
+    (entry,) = cache_dir.iterdir()
+
+    for data in (b"", b"garbage", entry.read_bytes()[:-8]):
+        entry.write_bytes(data)
+        template = expandvars.compile_file(path, cache_dir=str(cache_dir))
+        assert template.render(environ={}) == "a"
+
+    assert expandvars.compile_file(path, cache_dir=str(cache_dir)).render({}) == "a"
+
+
+def test_compile_file_cache_not_writable(tmp_path):
+    path = write(tmp_path / "app.conf", "$A")
+    not_a_dir = write(tmp_path / "file", "")
+
+    template = expandvars.compile_file(path, cache_dir=os.path.join(not_a_dir, "x"))
+    assert template.render(environ={"A": "a"}) == "a"
+
+
+def test_compile_file_cache_write_failure(tmp_path, monkeypatch):
+    path = write(tmp_path / "app.conf", "$A")
+    cache_dir = tmp_path / "cache"
+
+    def replace(src, dst):
+        raise PermissionError(dst)
+
+    monkeypatch.setattr(os, "replace", replace)
+    template = expandvars.compile_file(path, cache_dir=str(cache_dir))
+    assert template.render(environ={"A": "a"}) == "a"
+    assert cache_files(cache_dir) == []
+
+
+def test_compile_file_cache_syntax_error(tmp_path):
+    path = write(tmp_path / "app.conf", "ok\n${A")
+    cache_dir = tmp_path / "cache"
+
+    with pytest.raises(expandvars.MissingClosingBrace) as e:
+        expandvars.compile_file(path, cache_dir=str(cache_dir))
+    assert (e.value.line, e.value.column) == (2, 1)
+    assert not cache_dir.exists()
+
+
+def test_unflatten_truncated():
+    flat = expandvars._flatten(expandvars.compile("${A:-${B}}")._nodes)
+
+    with pytest.raises(ValueError):
+        expandvars._unflatten(flat[:1])
+
+
+def test_compile_file_cache_trimmed_concurrently(tmp_path, monkeypatch):
+    cache_dir = str(tmp_path / "cache")
+    expandvars.compile_file(write(tmp_path / "a.conf", "$A"), cache_dir=cache_dir)
+
+    def unlink(path):
+        raise FileNotFoundError(path)
+
+    monkeypatch.setattr(os, "unlink", unlink)
+    template = expandvars.compile_file(
+        write(tmp_path / "b.conf", "$B"), cache_dir=cache_dir, cache_size=0
+    )
+    assert template.render(environ={"B": "b"}) == "b"
+
+
+def test_compile_file_cache_dir_is_private(tmp_path):
+    cache_dir = tmp_path / "cache"
+    expandvars.compile_file(write(tmp_path / "a.conf", "$A"), cache_dir=str(cache_dir))
+
+    # There are no such permissions on Windows.
+    assert os.name == "nt" or cache_dir.stat().st_mode & 0o077 == 0
+
+
+def test_compile_file_cache_owned_by_another_user(tmp_path, monkeypatch):
+    path = write(tmp_path / "app.conf", "$A")
+    cache_dir = tmp_path / "cache"
+    expandvars.compile_file(path, cache_dir=str(cache_dir))
+    (entry,) = cache_dir.iterdir()
+
+    parsed = []
+    parse = expandvars._parse
+    monkeypatch.setattr(
+        expandvars,
+        "_parse",
+        lambda *args, **kw: parsed.append(args) or parse(*args, **kw),
+    )
+
+    def owned_except(path):
+        other = os.stat(str(path))
+        return lambda stat: not os.path.samestat(stat, other)
+
+    # Not loaded, but replaced with one of the current user.
+    monkeypatch.setattr(expandvars, "_owned", owned_except(entry))
+    template = expandvars.compile_file(path, cache_dir=str(cache_dir))
+    assert template.render(environ={"A": "a"}) == "a"
+    assert len(parsed) == 1
+    assert cache_files(cache_dir) == [entry.name]
+
+    # Neither loaded, nor replaced.
+    monkeypatch.setattr(expandvars, "_owned", owned_except(cache_dir))
+    mtime = entry.stat().st_mtime_ns
+    expandvars.compile_file(path, cache_dir=str(cache_dir))
+    assert len(parsed) == 2
+    assert entry.stat().st_mtime_ns == mtime
+
+
+def test_owned(tmp_path, monkeypatch):
+    stat = os.stat(str(tmp_path))
+
+    monkeypatch.setattr(os, "getuid", lambda: stat.st_uid, raising=False)
+    assert expandvars._owned(stat)
+    monkeypatch.setattr(os, "getuid", lambda: stat.st_uid + 1)
+    assert not expandvars._owned(stat)
+
+    # Files have no owners on Windows.
+    monkeypatch.delattr(os, "getuid")
+    assert expandvars._owned(stat)
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+
+import importlib
+import threading
+from os import environ as env
+from unittest.mock import patch
+
+import expandvars
+
+
+@patch.dict(env, {"FOO": "foo"}, clear=True)
+def test_environ_overlay():
+    importlib.reload(expandvars)
+
+    environ = expandvars.EnvironOverlay()
+    assert environ.maps[1] is env
+
+    assert expandvars.expand("$FOO:${BAR:=bar}:$BAR", environ=environ) == "foo:bar:bar"
+    assert expandvars.expand("${FOO:=new}", environ=environ) == "foo"
+    assert environ.assignments == {"BAR": "bar"}
+    assert environ["BAR"] == environ.get("BAR") == "bar"
+    assert environ.get("BAZ", "default") == "default"
+    assert dict(env) == {"FOO": "foo"}
+
+
+def test_environ_overlay_of_mapping():
+    source = {"FOO": "", "EXPANDVARS_RECOVER_NULL": "null"}
+    environ = expandvars.EnvironOverlay(source)
+
+    assert expandvars.expand("${FOO:=foo}$BAR", environ=environ, nounset=True) == (
+        "foonull"
+    )
+    assert environ.assignments == {"FOO": "foo"}
+    assert source == {"FOO": "", "EXPANDVARS_RECOVER_NULL": "null"}
+
+
+def test_environ_overlay_per_thread():
+    source = {}
+    template = expandvars.compile("${ID:=$THREAD}")
+    results = {}
+
+    def render(thread):
+        environ = expandvars.EnvironOverlay(source)
+        environ["THREAD"] = str(thread)
+        for _ in range(100):
+            assert template.render(environ=environ) == str(thread)
+        results[thread] = environ.assignments
+
+    threads = [threading.Thread(target=render, args=(i,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results == {i: {"THREAD": str(i), "ID": str(i)} for i in range(8)}
+    assert source == {}
@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+
+import importlib
+from os import environ as env
+from unittest.mock import patch
+
+import expandvars
+
+
+@patch.dict(env, {"FOO": "foo"}, clear=True)
+def test_environ_snapshot():
+    importlib.reload(expandvars)
+
+    environ = expandvars.EnvironSnapshot()
+    assert type(environ.environ) is type(env)
+    assert environ == {"FOO": "foo"}
+
+    env["FOO"] = "bar"
+    assert expandvars.expand("$FOO", environ=environ) == "foo"
+
+    environ.refresh()
+    assert expandvars.expand("$FOO", environ=environ) == "bar"
+
+
+@patch.dict(env, {}, clear=True)
+def test_environ_snapshot_write_through():
+    importlib.reload(expandvars)
+
+    environ = expandvars.EnvironSnapshot()
+
+    assert expandvars.expand("${FOO:=foo}", environ=environ) == "foo"
+    assert environ["FOO"] == env["FOO"] == "foo"
+
+
+def test_environ_snapshot_of_mapping():
+    source = {"FOO": "foo", "EXPANDVARS_RECOVER_NULL": "null"}
+    environ = expandvars.EnvironSnapshot(source)
+
+    assert expandvars.expand("$FOO:$BAR", environ=environ, nounset=True) == ("foo:null")
+
+    del source["EXPANDVARS_RECOVER_NULL"]
+    environ.refresh()
+    assert environ == {"FOO": "foo"}
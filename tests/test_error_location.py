@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+
+import expandvars
+
+
+def test_syntax_error_location():
+    with pytest.raises(expandvars.MissingClosingBrace) as e:
+        expandvars.expand("foo\nbar ${BAZ:-baz", environ={})
+
+    assert str(e.value) == "foo\nbar ${BAZ:-baz: missing '}'"
+    assert (e.value.position, e.value.line, e.value.column) == (8, 2, 5)
+    assert e.value.var == "BAZ"
+
+    with pytest.raises(expandvars.MissingEscapedChar) as e:
+        expandvars.expand("foo\\", environ={})
+    assert (e.value.position, e.value.line, e.value.column) == (3, 1, 4)
+    assert e.value.var is None
+
+    with pytest.raises(expandvars.BadSubstitution) as e:
+        expandvars.expand("${FOO:-${}}", environ={})
+    assert (e.value.position, e.value.line, e.value.column) == (7, 1, 8)
+
+
+def test_render_error_location():
+    with pytest.raises(expandvars.ParameterNullOrNotSet) as e:
+        expandvars.expand("$FOO\n  ${BAR:-${BAZ:?}}", environ={})
+
+    assert str(e.value) == "'BAZ: parameter null or not set'"
+    assert (e.value.position, e.value.line, e.value.column) == (14, 2, 10)
+    assert e.value.var == "BAZ"
+
+    with pytest.raises(expandvars.BadSubstitution) as e:
+        expandvars.expand("${FOO:-${#BAR:x}}", environ={})
+    assert str(e.value) == "${FOO:-${#BAR:x}}: bad substitution"
+    assert (e.value.position, e.value.var) == (7, "BAR")
+
+
+def test_long_input_error_message_is_truncated():
+    source = "$FOO " * 100 + "${BAR" + "\n$BAZ" * 100
+
+    with pytest.raises(expandvars.MissingClosingBrace) as e:
+        expandvars.expand(source, environ={})
+
+    assert str(e.value) == "...{0}${{BAR...: missing '}}'".format("$FOO " * 8)
+    assert (e.value.position, e.value.line, e.value.column) == (500, 1, 501)
+
+    with pytest.raises(expandvars.UnboundVariable) as e:
+        expandvars.expand(source.replace("${BAR", "$BAR"), environ={}, nounset=True)
+    assert (e.value.position, e.value.var) == (0, "FOO")
+
+    source = "${FOO:-" + "x" * 100 + "\n" + "${BAR}" * 100
+    with pytest.raises(expandvars.MissingClosingBrace) as e:
+        expandvars.expand(source, environ={})
+    assert str(e.value) == "${FOO:-" + "x" * 73 + "...: missing '}'"
+
+    with pytest.raises(expandvars.MissingEscapedChar) as e:
+        expandvars.expand("$FOO " * 100 + "\\", environ={})
+    assert str(e.value) == "...{0}\\: missing escaped character".format("$FOO " * 8)
+
+
+def test_stream_error_location():
+    chunks = ["$FOO ", "bar\nbaz", " ${BAZ", ":-baz"]
+
+    with pytest.raises(expandvars.MissingClosingBrace) as e:
+        list(expandvars.expand_stream(chunks, environ={}))
+
+    assert (e.value.position, e.value.line, e.value.column) == (13, 2, 5)
+
+    chunks = ["foo\n", "bar\n", "x${FOO:?}"]
+    with pytest.raises(expandvars.ParameterNullOrNotSet) as e:
+        list(expandvars.expand_stream(chunks, environ={}))
+
+    assert (e.value.position, e.value.line, e.value.column) == (9, 3, 2)
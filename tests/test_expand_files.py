@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+
+import os
+import pickle
+
+import pytest
+
+import expandvars
+
+
+@pytest.fixture
+def templates(tmp_path):
+    src = tmp_path / "src"
+    src.mkdir()
+    (src / "app.conf").write_text("host=$HOST\nport=${PORT:-8080}\n")
+    (src / "db.conf").write_text("url=${DB_URL:?}\n")
+    (src / "bad.conf").write_text("user=${USER\n")
+    (src / "assign.conf").write_text("${PORT:=1}$PORT\n")
+    os.chmod(str(src / "app.conf"), 0o640)
+
+    out = tmp_path / "out"
+    out.mkdir()
+    (out / "db.conf").write_text("previous\n")
+    return src, out
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_expand_files(templates, workers):
+    src, out = templates
+    paths = [str(src / name) for name in ["app.conf", "db.conf", "bad.conf"]]
+    paths.append(str(src / "missing.conf"))
+    paths.append(str(src / "assign.conf"))
+
+    errors = expandvars.expand_files(
+        paths, out_dir=str(out), workers=workers, environ={"HOST": "localhost"}
+    )
+
+    assert (out / "app.conf").read_text() == "host=localhost\nport=8080\n"
+    assert (out / "assign.conf").read_text() == "11\n"
+    # Only the read-only bit exists on Windows.
+    assert (
+        os.stat(str(out / "app.conf")).st_mode == os.stat(str(src / "app.conf")).st_mode
+    )
+
+    assert sorted(errors) == sorted(paths[1:4])
+    assert isinstance(errors[paths[1]], expandvars.ParameterNullOrNotSet)
+    assert str(errors[paths[1]]) == "'DB_URL: parameter null or not set'"
+    assert isinstance(errors[paths[2]], expandvars.MissingClosingBrace)
+    assert isinstance(errors[paths[3]], FileNotFoundError)
+
+    # Failed files are left untouched.
+    assert (out / "db.conf").read_text() == "previous\n"
+    assert sorted(os.listdir(str(out))) == ["app.conf", "assign.conf", "db.conf"]
+
+
+def test_expand_files_keeps_line_endings(tmp_path):
+    path = tmp_path / "crlf.conf"
+    path.write_bytes(b"a=$FOO\r\nb=${X:-y}\r\nc\rd\n")
+
+    assert expandvars.expand_files([str(path)], None, environ={"FOO": "foo"}) == {}
+    assert path.read_bytes() == b"a=foo\r\nb=y\r\nc\rd\n"
+
+
+def test_expand_files_creates_out_dir(tmp_path):
+    path = tmp_path / "app.conf"
+    path.write_text("$FOO")
+    out = tmp_path / "out" / "nested"
+
+    errors = expandvars.expand_files([str(path)], str(out), environ={"FOO": "foo"})
+    assert errors == {}
+    assert (out / "app.conf").read_text() == "foo"
+
+
+def test_expand_files_nothing_to_do(tmp_path):
+    assert expandvars.expand_files([], out_dir=str(tmp_path)) == {}
+
+
+def test_expand_files_duplicate_names(tmp_path):
+    with pytest.raises(ValueError, match="duplicate output file"):
+        expandvars.expand_files(["a/foo", "b/foo"], out_dir=str(tmp_path))
+
+
+def test_worker(templates):
+    src, out = templates
+    options = ({"HOST": "example.com"}, False, "$", False, "\\")
+
+    expandvars._init_worker(options)
+    job = (str(src / "app.conf"), str(out / "app.conf"))
+    assert expandvars._expand_file_in_worker(job) == (job[0], None)
+    assert (out / "app.conf").read_text() == "host=example.com\nport=8080\n"
+
+
+def test_exceptions_can_be_pickled():
+    errors = [
+        expandvars.MissingClosingBrace("${FOO"),
+        expandvars.MissingEscapedChar("\\"),
+        expandvars.OperandExpected("FOO", "@"),
+        expandvars.NegativeSubStringExpression("FOO", "-1"),
+        expandvars.BadSubstitution("${}"),
+        expandvars.ParameterNullOrNotSet("FOO"),
+        expandvars.UnboundVariable("FOO"),
+        expandvars.InvalidIndirectExpansion("FOO"),
+    ]
+    for error in errors:
+        copy = pickle.loads(pickle.dumps(error))
+        assert type(copy) is type(error)
+        assert str(copy) == str(error)
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+
+import importlib
+from os import environ as env
+from unittest.mock import patch
+
+import pytest
+
+import expandvars
+from tests import RecordingEnviron
+
+
+def test_expand_many():
+    environ = RecordingEnviron(FOO="foo", BAR="bar")
+    vars_list = ["$FOO", "${BAR}:$FOO", "plain", "$FOO", "${BAZ:-$FOO}"]
+
+    assert expandvars.expand_many(vars_list, environ=environ) == [
+        "foo",
+        "bar:foo",
+        "plain",
+        "foo",
+        "foo",
+    ]
+    assert sorted(environ.lookups) == ["BAR", "BAZ", "FOO"]
+
+
+def test_expand_many_parses_once(monkeypatch):
+    importlib.reload(expandvars)
+    parsed = []
+    original_compile = expandvars.compile
+
+    def compile(vars_, **kwargs):
+        parsed.append(vars_)
+        return original_compile(vars_, **kwargs)
+
+    monkeypatch.setattr(expandvars, "compile", compile)
+
+    vars_list = ["$A", "$B", "$A", "$A", "C"]
+    assert expandvars.expand_many(vars_list, environ={"A": "a"}) == [
+        "a",
+        "",
+        "a",
+        "a",
+        "C",
+    ]
+    assert parsed == ["$A", "$B"]
+
+
+def test_expand_many_returns_unchanged_strings():
+    plain = "".join(["/usr", "/bin"])
+    assert expandvars.expand_many([plain], environ={})[0] is plain
+
+
+def test_expand_many_assignments():
+    environ = {}
+    vars_list = ["$FOO", "${FOO:=foo}", "$FOO", "${FOO:=bar}"]
+
+    assert expandvars.expand_many(vars_list, environ=environ) == [
+        "",
+        "foo",
+        "foo",
+        "foo",
+    ]
+    assert environ == {"FOO": "foo"}
+
+
+def test_expand_many_lazy():
+    environ = RecordingEnviron(FOO="foo")
+    expanded = expandvars.expand_many(["$FOO", "$$BAR"], environ=environ, lazy=True)
+
+    assert environ.lookups == []
+    assert next(expanded) == "foo"
+    assert environ.lookups == ["FOO"]
+    assert list(expanded) == [""]
+
+
+def test_expand_many_options():
+    vars_list = ["%{FOO}", "%FOO", "\\%{FOO}"]
+
+    assert expandvars.expand_many(
+        vars_list, environ={"FOO": "foo"}, var_symbol="%", surrounded_vars_only=True
+    ) == ["foo", "%FOO", "%{FOO}"]
+
+    assert expandvars.expand_many(
+        vars_list, environ={"FOO": "foo"}, var_symbol="%", escape_char=None
+    ) == ["foo", "foo", "\\foo"]
+
+
+@patch.dict(env, {"EXPANDVARS_RECOVER_NULL": "null"}, clear=True)
+def test_expand_many_nounset():
+    importlib.reload(expandvars)
+
+    assert expandvars.expand_many(["$FOO"], nounset=True) == ["null"]
+
+    with pytest.raises(expandvars.UnboundVariable):
+        expandvars.expand_many(["$FOO"], environ={}, nounset=True)
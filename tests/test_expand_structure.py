@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+
+import pickle
+from collections import OrderedDict, defaultdict, namedtuple
+from unittest.mock import patch
+
+import pytest
+
+import expandvars
+from tests import RecordingEnviron
+
+Point = namedtuple("Point", "x y")
+
+
+@patch.dict("os.environ", {"HOST": "db", "PORT": "5432"}, clear=True)
+def test_expand_structure():
+    config = {
+        "db": {"url": "postgres://$HOST:$PORT", "hosts": ["$HOST", "replica"]},
+        "ports": ("${PORT}", 80),
+        "point": Point("$PORT", None),
+        "ordered": OrderedDict(host="$HOST"),
+        "static": {"name": "app", "tags": ["a", "b"], "debug": False},
+        "$HOST": 1.5,
+    }
+
+    assert expandvars.expand_structure(config) == {
+        "db": {"url": "postgres://db:5432", "hosts": ["db", "replica"]},
+        "ports": ("5432", 80),
+        "point": Point("5432", None),
+        "ordered": OrderedDict(host="db"),
+        "static": {"name": "app", "tags": ["a", "b"], "debug": False},
+        "$HOST": 1.5,
+    }
+    assert config["db"]["url"] == "postgres://$HOST:$PORT"
+
+    assert expandvars.expand_structure("$HOST") == "db"
+    assert expandvars.expand_structure(42) == 42
+    assert expandvars.expand_structure({"$HOST": "$PORT"}, keys=True) == {"db": "5432"}
+
+
+def test_expand_structure_does_not_copy_unchanged_subtrees():
+    config = {
+        "static": {"tags": ["a", ("b",)], "url": "https://example.com"},
+        "dynamic": {"host": "$HOST", "same": {"value": "$SAME"}},
+    }
+
+    expanded = expandvars.expand_structure(config, environ={"HOST": "db", "SAME": "x"})
+
+    assert expanded is not config
+    assert expanded["static"] is config["static"]
+    assert expanded["dynamic"] is not config["dynamic"]
+
+    config = {"host": "$HOST", "items": ["text", "$HOST"]}
+    assert expandvars.expand_structure(config, environ={"HOST": "$HOST"}) is config
+
+
+def test_expand_structure_memoizes_strings():
+    environ = RecordingEnviron(HOST="h")
+    config = [{"url": "http://$HOST", "x": "${N:=1}"} for _ in range(100)]
+    expanded = expandvars.expand_structure(config, environ=environ)
+
+    assert expanded == [{"url": "http://h", "x": "1"}] * 100
+    assert environ.lookups == ["HOST", "N"]
+
+    # Strings with assignments are expanded again every time.
+    environ = {}
+    assert expandvars.expand_structure(["$A${A:=a}", "$A${A:=a}"], environ=environ) == [
+        "a",
+        "aa",
+    ]
+    assert environ == {"A": "a"}
+
+
+def test_expand_structure_sees_earlier_assignments():
+    environ = {}
+    assert expandvars.expand_structure(["$A", "${A:=x}", "$A"], environ=environ) == [
+        "",
+        "x",
+        "x",
+    ]
+    assert environ == {"A": "x"}
+
+
+def test_expand_structure_dict_subclasses():
+    config = defaultdict(list, {"host": "$HOST", "port": 80})
+    expanded = expandvars.expand_structure(config, environ={"HOST": "db"})
+
+    assert type(expanded) is defaultdict
+    assert expanded == {"host": "db", "port": 80}
+    assert expanded.default_factory is list
+    assert config["host"] == "$HOST"
+
+
+def test_expand_structure_options():
+    assert expandvars.expand_structure(
+        {"%{FOO}": ["%FOO", "%{FOO}"]},
+        environ={"FOO": "foo"},
+        var_symbol="%",
+        surrounded_vars_only=True,
+        keys=True,
+    ) == {"foo": ["%FOO", "foo"]}
+
+
+def test_expand_structure_errors():
+    config = {"db": {"hosts": ["$HOST", "${REPLICA:?}"]}}
+
+    with pytest.raises(expandvars.ParameterNullOrNotSet) as e:
+        expandvars.expand_structure(config, environ={"HOST": "db"})
+    assert e.value.path == ("db", "hosts", 1)
+    assert e.value.var == "REPLICA"
+    assert pickle.loads(pickle.dumps(e.value)).path == ("db", "hosts", 1)
+
+    with pytest.raises(expandvars.UnboundVariable) as e:
+        expandvars.expand_structure(config, environ={}, nounset=True)
+    assert e.value.path == ("db", "hosts", 0)
+
+    with pytest.raises(expandvars.MissingClosingBrace) as e:
+        expandvars.expand_structure({"${KEY": "value"}, keys=True)
+    assert e.value.path == ("${KEY",)
+
+    with pytest.raises(expandvars.UnboundVariable) as e:
+        expandvars.expandvars("$UNSET_VARIABLE", nounset=True)
+    assert e.value.path is None
@@ -8,6 +8,7 @@ from unittest.mock import patch
 import pytest
 
 import expandvars
+from tests import RecordingEnviron
 
 
 def test_unset_var_substring():
@@ -126,6 +127,25 @@ def test_expandvars_substitute():
     assert expandvars.expandvars("${FOO:+\\$foo}-\\$foo") == "$foo-$foo"
 
 
+def test_unused_operands_are_not_expanded():
+    environ = RecordingEnviron(FOO="foo", EMPTY="")
+
+    assert expandvars.expand("${FOO:-${SLOW}}", environ=environ) == "foo"
+    assert expandvars.expand("${FOO:=${SLOW}}", environ=environ) == "foo"
+    assert expandvars.expand("${FOO:?${SLOW}}", environ=environ) == "foo"
+    assert expandvars.expand("${EMPTY:+${SLOW}}", environ=environ) == ""
+    assert environ.lookups == ["FOO", "FOO", "FOO", "EMPTY"]
+
+    assert expandvars.expand("${FOO:-${BAR:=bar}}", environ=environ) == "foo"
+    assert expandvars.expand("${FOO:-${BAR:?}}${FOO:-${!BAR}}", environ=environ) == (
+        "foofoo"
+    )
+    assert "BAR" not in environ
+
+    assert expandvars.expand("${EMPTY:-${BAR:=bar}}", environ=environ) == "bar"
+    assert environ["BAR"] == "bar"
+
+
 @patch.dict(env, {"FOO": "damnbigfoobar", "THREE": "3"}, clear=True)
 def test_offset():
     importlib.reload(expandvars)
@@ -425,3 +445,23 @@ def test_expandvars_disable_escape():
         expandvars.expand("\\foo\\", surrounded_vars_only=True, escape_char=None)
         == "\\foo\\"
     )
+
+
+@patch.dict(env, {"FOO": "bar"}, clear=True)
+def test_expandvars_returns_unchanged_input():
+    importlib.reload(expandvars)
+
+    plain = "".join(["/usr/local", "/bin"])
+    assert expandvars.expandvars(plain) is plain
+    assert expandvars.expand(plain, var_symbol="%") is plain
+    assert expandvars.cache_info().currsize == 0
+
+    empty = ""
+    assert expandvars.expandvars(empty) is empty
+
+    windows = "C:\\Users\\foo"
+    assert expandvars.expand(windows, escape_char=None) is windows
+    assert expandvars.expandvars(windows) == windows
+    assert expandvars.expandvars(windows) is not windows
+
+    assert expandvars.expand("100%", var_symbol="%") == "100%"
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+
+import expandvars
+from tests import RecordingEnviron
+
+
+class Store(RecordingEnviron):
+    """An in-memory stand-in for a remote store, recording the round trips."""
+
+    def get_many(self, names):
+        self.lookups.append(sorted(names))
+        return {name: self[name] for name in names if name in self}
+
+
+def test_get_many():
+    store = Store(HOST="db", USER="admin")
+    template = expandvars.compile("$USER@$HOST:${PORT:-${DEFAULT_PORT:-5432}}/$USER")
+
+    assert template.render(environ=store) == "admin@db:5432/admin"
+    assert store.lookups == [["DEFAULT_PORT", "HOST", "PORT", "USER"]]
+
+    store.lookups = []
+    assert expandvars.expand("$HOST", environ=store) == "db"
+    assert store.lookups == [["HOST"]]
+
+
+def test_get_many_indirect():
+    store = Store(REF="TARGET", TARGET="value", PID="$", EMPTY="")
+
+    assert expandvars.expand("${!REF}${!PID}$REF$$", environ=store).startswith("value")
+    assert store.lookups == [["PID", "REF"], ["TARGET"]]
+
+    store.lookups = []
+    assert expandvars.expand("${!REF}$TARGET", environ=store) == "valuevalue"
+    assert store.lookups == [["REF", "TARGET"]]
+
+    with pytest.raises(expandvars.InvalidIndirectExpansion):
+        expandvars.expand("${!MISSING}", environ=store)
+
+
+def test_get_many_assignments():
+    store = Store()
+
+    assert expandvars.expand("${FOO:=foo}$FOO", environ=store) == "foofoo"
+    assert store == {"FOO": "foo"}
+    assert store.lookups == [["FOO"]]
+
+
+def test_get_many_strict():
+    store = Store(EXPANDVARS_RECOVER_NULL="null")
+
+    assert expandvars.expand("${FOO:?}", environ=store) == "null"
+    assert expandvars.expand("$BAR", environ=store, nounset=True) == "null"
+    assert store.lookups == [
+        ["EXPANDVARS_RECOVER_NULL", "FOO"],
+        ["BAR", "EXPANDVARS_RECOVER_NULL"],
+    ]
+
+
+def test_get_many_expand_many():
+    store = Store(FOO="foo", BAR="bar")
+
+    assert expandvars.expand_many(["$FOO", "$FOO$BAR", "$FOO"], environ=store) == [
+        "foo",
+        "foobar",
+        "foo",
+    ]
+    assert store.lookups == [["FOO"], ["BAR"]]
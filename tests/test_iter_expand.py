@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+
+import io
+from unittest.mock import patch
+
+import pytest
+
+import expandvars
+
+
+@patch.dict("os.environ", {"HOST": "localhost", "EMPTY": ""}, clear=True)
+def test_iter_expand():
+    assert list(expandvars.iter_expand("$HOST:${PORT:-${DEFAULT:-80}}$EMPTY/")) == [
+        "localhost",
+        ":",
+        "80",
+        "/",
+    ]
+    assert list(expandvars.iter_expand("\\$HOST")) == ["$HOST"]
+    assert list(expandvars.iter_expand("no variables")) == ["no variables"]
+    assert list(expandvars.iter_expand("")) == []
+
+
+def test_iter_expand_is_lazy():
+    environ = {"FOO": "foo"}
+    pieces = expandvars.iter_expand("$FOO ${BAR:=bar}", environ=environ)
+
+    assert next(pieces) == "foo"
+    assert environ == {"FOO": "foo"}
+    assert list(pieces) == [" ", "bar"]
+    assert environ == {"FOO": "foo", "BAR": "bar"}
+
+
+def test_iter_expand_options():
+    assert list(
+        expandvars.iter_expand(
+            "%FOO%{FOO}$FOO",
+            environ={"FOO": "foo"},
+            var_symbol="%",
+            surrounded_vars_only=True,
+        )
+    ) == ["%FOO", "foo", "$FOO"]
+
+
+def test_iter_expand_bytes():
+    environ = {b"FOO": b"foo"}
+
+    assert list(expandvars.iter_expand(b"[$FOO]", environ=environ)) == [
+        b"[",
+        b"foo",
+        b"]",
+    ]
+    assert list(expandvars.iter_expand(bytearray(b"none"), environ=environ)) == [
+        b"none"
+    ]
+
+
+def test_iter_expand_errors():
+    pieces = expandvars.iter_expand("$FOO\n${BAR:?}", environ={"FOO": "foo"})
+
+    assert next(pieces) == "foo"
+    with pytest.raises(expandvars.ParameterNullOrNotSet) as e:
+        list(pieces)
+    assert (e.value.line, e.value.column) == (2, 1)
+
+    with pytest.raises(expandvars.UnboundVariable):
+        list(expandvars.iter_expand("${FOO:-$BAR}$BAR", environ={}, nounset=True))
+
+
+def test_iter_render_get_many():
+    class Store(dict):
+        def get_many(self, names):
+            self.names = sorted(names)
+            return {name: self[name] for name in names if name in self}
+
+    store = Store(FOO="foo")
+    template = expandvars.compile("$FOO${BAR:-bar}")
+
+    assert list(template.iter_render(environ=store)) == ["foo", "bar"]
+    assert store.names == ["BAR", "FOO"]
+
+
+def test_expand_into():
+    out = io.StringIO()
+    expandvars.expand_into("$FOO/${BAR:-bar}", out, environ={"FOO": "foo"})
+    assert out.getvalue() == "foo/bar"
+
+    out = io.BytesIO()
+    expandvars.expand_into(b"$FOO!", out, environ={b"FOO": b"foo"})
+    assert out.getvalue() == b"foo!"
+
+    out = io.StringIO()
+    with pytest.raises(expandvars.UnboundVariable):
+        expandvars.expand_into("$FOO:$BAR", out, environ={"FOO": "foo"}, nounset=True)
+    assert out.getvalue() == "foo:"
+
+
+def test_iter_expand_file(tmp_path):
+    path = tmp_path / "app.conf"
+    path.write_text("host=$FOO\n" * 10000)
+
+    with open(path) as f:
+        pieces = list(expandvars.iter_expand(f, environ={"FOO": "foo"}))
+    assert "".join(pieces) == "host=foo\n" * 10000
+    # Read chunk by chunk.
+    assert len(pieces) == 2
+
+    out = io.StringIO()
+    with open(path) as f:
+        expandvars.expand_into(f, out, environ={"FOO": "foo"})
+    assert out.getvalue() == "host=foo\n" * 10000
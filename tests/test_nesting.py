@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+
+import expandvars
+
+
+def test_parsing_deeply_nested_defaults(monkeypatch):
+    monkeypatch.setattr(expandvars, "MAX_DEPTH", 10000)
+
+    depth = 5000
+    nested = "${A:-" * depth + "x" + "}" * depth
+    assert expandvars.expand(nested, environ={}) == "x"
+    assert expandvars.expand(nested, environ={"A": "a"}) == "a"
+
+
+def test_nesting_too_deep(monkeypatch):
+    monkeypatch.setattr(expandvars, "MAX_DEPTH", 3)
+
+    assert expandvars.expand("${A:-${B:-${C:-c}}}", environ={}) == "c"
+    with pytest.raises(expandvars.NestingTooDeep) as e:
+        expandvars.compile("${A:-${B:-${C:-${D:-d}}}}")
+    assert str(e.value) == (
+        "${A:-${B:-${C:-${D:-d}}}}: expressions nested more than 3 levels deep"
+    )
+    assert isinstance(e.value, RecursionError)
+
+
+def test_closing_brace_search_stops_at_the_closing_brace():
+    brace_re = expandvars._TEXT_SYNTAX.brace_re
+    text = "a{b{c}}d} {e} {"
+    braces = {}
+
+    assert expandvars._find_closing_brace(text, 0, len(text), braces, brace_re) == 8
+    # Only the pairs before it were scanned, and are then jumped over.
+    assert braces == {1: 6, 3: 5}
+    assert expandvars._find_closing_brace(text, 2, len(text), braces, brace_re) == 6
+    assert expandvars._find_closing_brace(text, 9, len(text), braces, brace_re) is None
@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+
+from unittest.mock import patch
+
+import pytest
+
+import expandvars
+
+ENVIRON = {
+    "PATH": "/usr/local/bin:/usr/bin",
+    "IMAGE": "repo/app:latest",
+    "FILE": "archive.tar.gz",
+    "GREETING": "hello world",
+    "EMPTY": "",
+    "REF": "FILE",
+}
+
+
+@pytest.mark.parametrize(
+    "vars_, expected",
+    [
+        ("${FILE#*.}", "tar.gz"),
+        ("${FILE##*.}", "gz"),
+        ("${FILE%.*}", "archive.tar"),
+        ("${FILE%%.*}", "archive"),
+        ("${PATH%/*}", "/usr/local/bin:/usr"),
+        ("${PATH##*/}", "bin"),
+        ("${FILE#x*}", "archive.tar.gz"),
+        ("${FILE%x}", "archive.tar.gz"),
+        ("${FILE#}", "archive.tar.gz"),
+        ("${FILE#a?c}", "hive.tar.gz"),
+        ("${FILE#[a-c]}", "rchive.tar.gz"),
+        ("${FILE#[!a-c]}", "archive.tar.gz"),
+        ("${FILE%[^a-y]}", "archive.tar.g"),
+        ("${FILE#[]a]}", "rchive.tar.gz"),
+        ("${FILE#[a}", "archive.tar.gz"),
+        ("${FILE%\\.gz}", "archive.tar"),
+        ("${FILE%\\*}", "archive.tar.gz"),
+        ("${FILE%.$EMPTY*}", "archive.tar"),
+        ("${!REF%%.*}", "archive"),
+    ],
+)
+def test_remove_prefix_and_suffix(vars_, expected):
+    assert expandvars.expand(vars_, environ=ENVIRON) == expected
+
+
+@pytest.mark.parametrize(
+    "vars_, expected",
+    [
+        ("${IMAGE/:latest/:v2}", "repo/app:v2"),
+        ("${FILE/./_}", "archive_tar.gz"),
+        ("${FILE//./_}", "archive_tar_gz"),
+        ("${FILE//[a-r]/-}", "-----v-.t--.-z"),
+        ("${FILE/a*./x}", "xgz"),
+        ("${FILE/*/x}", "x"),
+        ("${FILE//*/x}", "x"),
+        ("${FILE/.}", "archivetar.gz"),
+        ("${FILE//.}", "archivetargz"),
+        ("${FILE/x/y}", "archive.tar.gz"),
+        ("${FILE/}", "archive.tar.gz"),
+        ("${FILE//}", "archive.tar.gz"),
+        ("${FILE/#arch/ARCH}", "ARCHive.tar.gz"),
+        ("${FILE/#tar/x}", "archive.tar.gz"),
+        ("${FILE/#/>}", ">archive.tar.gz"),
+        ("${FILE/%gz/bz2}", "archive.tar.bz2"),
+        ("${FILE/%.*/}", "archive"),
+        ("${FILE/%tar/x}", "archive.tar.gz"),
+        ("${FILE/%/<}", "archive.tar.gz<"),
+        ("${IMAGE/\\//:}", "repo:app:latest"),
+        ("${IMAGE//a/$EMPTY/}", "repo//pp:l/test"),
+        ("${IMAGE/${EMPTY:-app}/${FILE%%.*}}", "repo/archive:latest"),
+        ("${IMAGE/$EMPTY:*/}", "repo/app"),
+        ("${EMPTY/#/x}", "x"),
+        ("${EMPTY//*/x}", ""),
+    ],
+)
+def test_replace(vars_, expected):
+    assert expandvars.expand(vars_, environ=ENVIRON) == expected
+
+
+@pytest.mark.parametrize(
+    "vars_, expected",
+    [
+        ("${GREETING^}", "Hello world"),
+        ("${GREETING^^}", "HELLO WORLD"),
+        ("${GREETING^^[lo]}", "heLLO wOrLd"),
+        ("${GREETING^[!h]}", "hello world"),
+        ("${GREETING^^*}", "HELLO WORLD"),
+        ("${IMAGE,}", "repo/app:latest"),
+        ("${GREETING^^},${GREETING,,}", "HELLO WORLD,hello world"),
+        ("${EMPTY^^}", ""),
+    ],
+)
+def test_case_modification(vars_, expected):
+    assert expandvars.expand(vars_, environ=ENVIRON) == expected
+
+
+def test_case_modification_unicode():
+    environ = {"NAME": "élan straße ÿ", "UPPER": "ÉLAN"}
+
+    assert expandvars.expand("${NAME^^}", environ=environ) == "ÉLAN STRAßE ÿ"
+    assert expandvars.expand("${NAME^}", environ=environ) == "Élan straße ÿ"
+    assert expandvars.expand("${UPPER,,}", environ=environ) == "élan"
+    assert expandvars.expand("${UPPER,,[É]}", environ=environ) == "éLAN"
+
+
+def test_pattern_operators_bytes():
+    environ = {b"FILE": b"archive.tar.gz", b"NAME": b"\xe9\xff"}
+
+    assert expandvars.expand(b"${FILE%%.*}", environ=environ) == b"archive"
+    assert expandvars.expand(b"${FILE//./_}", environ=environ) == b"archive_tar_gz"
+    assert expandvars.expand(bytearray(b"${FILE/#a/A}"), environ=environ) == (
+        b"Archive.tar.gz"
+    )
+    # Only ASCII letters are converted, the other bytes are left alone.
+    assert expandvars.expand(b"${NAME^^}", environ=environ) == b"\xe9\xff"
+
+
+def test_case_modification_bytes_utf8():
+    environ = {b"UPPER": "CAFÉ".encode(), b"LOWER": "éte".encode()}
+
+    assert expandvars.expand(b"${UPPER,,}", environ=environ) == "cafÉ".encode()
+    assert expandvars.expand(b"${UPPER,}", environ=environ) == "cAFÉ".encode()
+    assert expandvars.expand(b"${LOWER^^}", environ=environ) == "éTE".encode()
+    assert expandvars.expand(b"${LOWER^}", environ=environ) == "éte".encode()
+    assert expandvars.expand(b"${LOWER^^[!t]}", environ=environ) == "étE".encode()
+
+
+def test_pattern_operators_unset():
+    assert expandvars.expand("${UNSET#*}${UNSET//a/b}${UNSET^^}", environ={}) == ""
+    assert expandvars.expand("${UNSET/#/x}", environ={}) == ""
+
+    with pytest.raises(expandvars.UnboundVariable):
+        expandvars.expand("${UNSET%x}", environ={}, nounset=True)
+
+
+def test_pattern_operators_after_colon():
+    # After a colon, they are still part of the offset.
+    assert expandvars.expand("${FILE:#}", environ=ENVIRON) == "archive.tar.gz"
+    assert expandvars.expand("${FILE:%1}", environ=ENVIRON) == "archive.tar.gz"
+
+
+@patch.dict("os.environ", {"FILE": "archive.tar.gz"}, clear=True)
+def test_pattern_operators_referenced_vars_and_templates():
+    template = expandvars.compile("${FILE%.${EXT:-gz}}${FILE//a/$B}")
+
+    assert template.referenced_vars().names == {"FILE", "EXT", "B"}
+    assert template.render() == "archive.tarrchive.tr.gz"
+    assert template.render(environ={"FILE": "a.b", "EXT": "b", "B": "_"}) == "a_.b"
+
+
+def test_glob_re_is_cached():
+    expandvars._glob_re.cache_clear()
+    template = expandvars.compile("${FILE%.*}")
+
+    for _ in range(10):
+        template.render(environ=ENVIRON)
+
+    assert expandvars._glob_re.cache_info().misses == 1
+    assert expandvars._glob_re.cache_info().maxsize == 256
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+
+import expandvars
+
+
+def test_referenced_vars():
+    refs = expandvars.referenced_vars(
+        "$HOST:${PORT:-${DEFAULT_PORT}}/${!DB}?user=${USER:=admin}&n=${#USER}"
+        "&${NAME:?}${TAG:+:$TAG}${HOST:0:3}$$"
+    )
+
+    assert refs.direct == {"HOST", "DEFAULT_PORT", "NAME", "TAG"}
+    assert refs.indirect == {"DB"}
+    assert refs.defaulted == {"PORT"}
+    assert refs.assigned == {"USER"}
+    assert refs.length == {"USER"}
+    assert refs.names == {"HOST", "PORT", "DEFAULT_PORT", "DB", "USER", "NAME", "TAG"}
+
+
+def test_referenced_vars_of_template():
+    template = expandvars.compile("${FOO:=${BAR:?}}")
+
+    assert template.referenced_vars() == expandvars.References(
+        direct=frozenset({"BAR"}),
+        indirect=frozenset(),
+        defaulted=frozenset(),
+        assigned=frozenset({"FOO"}),
+        length=frozenset(),
+    )
+
+
+def test_referenced_vars_options():
+    assert expandvars.referenced_vars("$FOO").names == {"FOO"}
+    assert expandvars.referenced_vars("$FOO", var_symbol="%").names == set()
+    assert expandvars.referenced_vars("%FOO", var_symbol="%").names == {"FOO"}
+    assert expandvars.referenced_vars("\\$FOO${BAR}").names == {"BAR"}
+    assert expandvars.referenced_vars(
+        "$FOO${BAR}", surrounded_vars_only=True
+    ).names == {"BAR"}
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+
+import expandvars
+
+
+def test_stats():
+    stats = expandvars.Stats()
+    environ = {"FOO": "foo", "EMPTY": ""}
+
+    assert expandvars.expand("$FOO:${BAR:-bar}", environ=environ, stats=stats) == (
+        "foo:bar"
+    )
+    assert expandvars.expand("${EMPTY:=x}${EMPTY:=y}", environ=environ, stats=stats)
+    assert expandvars.expand("plain text", environ=environ, stats=stats)
+
+    assert stats.expansions == 3
+    assert stats.chars == len("$FOO:${BAR:-bar}${EMPTY:=x}${EMPTY:=y}plain text")
+    assert stats.lookups == 4
+    assert stats.unset == 1
+    assert stats.defaults == 2
+    assert stats.assignments == 1
+    assert stats.recovered_null == 0
+    assert stats.time > 0
+    assert repr(stats).startswith("Stats(expansions=3, chars=48, lookups=4, unset=1,")
+
+    stats.reset()
+    assert repr(stats) == (
+        "Stats(expansions=0, chars=0, lookups=0, unset=0, recovered_null=0, "
+        "defaults=0, assignments=0, time=0.0)"
+    )
+
+
+def test_stats_recovered_null():
+    stats = expandvars.Stats()
+    environ = {"EXPANDVARS_RECOVER_NULL": "null"}
+
+    assert expandvars.expand("$FOO${BAR:?}", environ=environ, nounset=True, stats=stats)
+    assert (stats.lookups, stats.unset, stats.recovered_null) == (2, 2, 2)
+
+    with pytest.raises(expandvars.UnboundVariable):
+        expandvars.expand("$FOO", environ={}, nounset=True, stats=stats)
+    assert stats.expansions == 2
+
+
+def test_on_lookup():
+    lookups = []
+
+    def on_lookup(name, found, elapsed):
+        assert elapsed >= 0
+        lookups.append((name, found))
+
+    template = expandvars.compile("$FOO ${!REF} ${BAR:-$FOO}")
+    environ = {"FOO": "foo", "REF": "FOO"}
+
+    assert template.render(environ=environ, on_lookup=on_lookup) == "foo foo foo"
+    assert lookups == [
+        ("FOO", True),
+        ("REF", True),
+        ("FOO", True),
+        ("BAR", False),
+        ("FOO", True),
+    ]
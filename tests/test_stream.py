@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+
+import importlib
+import io
+from os import environ as env
+from unittest.mock import patch
+
+import pytest
+
+import expandvars
+
+ENVIRON = {"FOO": "foo", "BAR": "bar", "FOOBAR": "foobar", "EMPTY": ""}
+TEMPLATES = [
+    "plain text",
+    "$FOO:$BAR $FOOBAR",
+    "${FOO}x${BAR:-default}${BAZ:-${FOO}-${BAR}}y",
+    "\\$FOO\\\\$BAR\\x",
+    "$$FOO$FOO{BAR}",
+    "${FOO:1:1}${#FOOBAR}${!EMPTY-indirect}${FOO:+{}}{}",
+    "100% $ {",
+]
+
+
+def test_expand_stream_chunk_boundaries():
+    importlib.reload(expandvars)
+
+    for template in TEMPLATES:
+        expected = expandvars.expand(template, environ=ENVIRON)
+
+        chunks = list(template)
+        assert "".join(expandvars.expand_stream(chunks, environ=ENVIRON)) == expected
+
+        for i in range(len(template) + 1):
+            chunks = [template[:i], template[i:]]
+            expanded = expandvars.expand_stream(chunks, environ=ENVIRON)
+            assert "".join(expanded) == expected
+
+
+def test_expand_stream_yields_as_it_goes():
+    chunks = iter(["$FOO ", "${BAR", ":-x} ", "$FOO"])
+    expanded = expandvars.expand_stream(chunks, environ=ENVIRON)
+
+    assert next(expanded) == "foo "
+    assert next(expanded) == "bar "
+    assert next(expanded) == "foo"
+    assert next(expanded, None) is None
+
+
+def test_expand_stream_options():
+    chunks = ["%{FOO}%", "FOO \\%{BAR}"]
+    expanded = expandvars.expand_stream(
+        chunks, environ=ENVIRON, var_symbol="%", surrounded_vars_only=True
+    )
+
+    assert "".join(expanded) == "foo%FOO %{BAR}"
+
+
+def test_expand_stream_assignments():
+    environ = {}
+    chunks = ["${FOO:=", "foo}", " $FOO"]
+
+    assert "".join(expandvars.expand_stream(chunks, environ=environ)) == "foo foo"
+    assert environ == {"FOO": "foo"}
+
+
+@patch.dict(env, {"FOO": "bar"}, clear=True)
+def test_expand_stream_from_file():
+    importlib.reload(expandvars)
+
+    with open("tests/data/foo.txt") as f:
+        assert "".join(expandvars.expand_stream(f, chunk_size=1)) == "bar:bar\n"
+
+    f = io.StringIO("$FOO" * 100)
+    expanded = list(expandvars.expand_stream(f, chunk_size=10))
+    assert len(expanded) == 41
+    assert "".join(expanded) == "bar" * 100
+
+
+def test_expand_stream_errors():
+    with pytest.raises(expandvars.MissingClosingBrace) as e:
+        list(expandvars.expand_stream(["$FOO ", "${BAR"], environ=ENVIRON))
+    assert str(e.value) == "${BAR: missing '}'"
+
+    with pytest.raises(expandvars.MissingEscapedChar):
+        list(expandvars.expand_stream(["$FOO\\"], environ=ENVIRON))
+
+    with pytest.raises(expandvars.UnboundVariable):
+        list(expandvars.expand_stream(["$BAZ"], environ=ENVIRON, nounset=True))
+
+
+def test_expand_stream_parses_open_expressions_once(monkeypatch):
+    calls = []
+    compile_ = expandvars._compile
+
+    def counting_compile(vars_, *args, **kwargs):
+        calls.append(len(vars_))
+        return compile_(vars_, *args, **kwargs)
+
+    monkeypatch.setattr(expandvars, "_compile", counting_compile)
+    chunks = ["$FOO ${BAR:-", "{x}"] + ["y"] * 1000 + ["} ${BAR", "}"]
+    expanded = "".join(expandvars.expand_stream(chunks, environ=ENVIRON))
+
+    assert expanded == "foo bar bar"
+    assert calls == [12, 1017, 6, 0]
+
+
+def test_expand_stream_max_pending():
+    chunks = ["ok\n ${FOO:-", "x" * 10, "}\n${BAR"] + ["y"] * 100
+    expanded = expandvars.expand_stream(chunks, environ=ENVIRON, max_pending=20)
+
+    assert next(expanded) == "ok\n "
+    assert next(expanded) == "foo\n"
+    with pytest.raises(expandvars.MissingClosingBrace) as e:
+        next(expanded)
+    assert (e.value.line, e.value.column, e.value.position) == (3, 1, 23)
+
+    # Held back expressions that more input can still complete are kept.
+    chunks = ["$", "FOO ${", "BAR}"]
+    assert "".join(
+        expandvars.expand_stream(chunks, environ=ENVIRON, max_pending=0)
+    ) == ("foo bar")
@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+
+import expandvars
+from tests import RecordingEnviron
+
+
+def test_template_set():
+    environ = RecordingEnviron(HOST="localhost", PORT="8080")
+    templates = expandvars.TemplateSet(
+        {"app": "http://$HOST:$PORT", "db": "host=$HOST", "static": "static"},
+        environ=environ,
+    )
+
+    assert list(templates) == ["app", "db", "static"]
+    assert len(templates) == 3
+    assert "app" in templates and "other" not in templates
+    assert templates["app"] == "http://localhost:8080"
+    assert templates["db"] == "host=localhost"
+    assert templates["static"] == "static"
+    assert templates.dependencies("app") == {"HOST", "PORT"}
+    assert templates.dependencies("static") == set()
+
+    environ["PORT"] = "80"
+    environ.lookups = []
+    assert templates.refresh(["PORT"]) == {"app"}
+    assert environ.lookups == ["HOST", "PORT"]
+    assert templates["app"] == "http://localhost:80"
+
+    environ.lookups = []
+    assert templates.refresh(["UNUSED"]) == set()
+    assert environ.lookups == []
+
+    # Rendered again, but the output is the same.
+    assert templates.refresh(["HOST", "PORT"]) == set()
+    assert templates.refresh() == set()
+
+    environ["HOST"] = "db"
+    assert templates.refresh() == {"app", "db"}
+    assert templates["db"] == "host=db"
+
+
+def test_template_set_add_remove():
+    templates = expandvars.TemplateSet(environ={"FOO": "foo"})
+
+    assert templates.add("a", "$FOO") == {"a"}
+    assert templates.add("b", "$FOO$FOO") == {"b"}
+    assert templates.add("a", "[$FOO]") == {"a"}
+    assert list(templates) == ["a", "b"]
+    assert templates["a"] == "[foo]"
+
+    templates.remove("a")
+    assert "a" not in templates
+    assert templates.refresh(["FOO"]) == set()
+    with pytest.raises(KeyError):
+        templates["a"]
+    with pytest.raises(KeyError):
+        templates.remove("a")
+
+
+def test_template_set_indirect():
+    environ = {"REF": "ONE", "ONE": "1", "TWO": "2"}
+    templates = expandvars.TemplateSet({"value": "${!REF}"}, environ=environ)
+
+    assert templates["value"] == "1"
+    assert templates.dependencies("value") == {"REF", "ONE"}
+
+    environ["ONE"] = "one"
+    assert templates.refresh(["ONE"]) == {"value"}
+    assert templates["value"] == "one"
+
+    environ["REF"] = "TWO"
+    assert templates.refresh(["REF"]) == {"value"}
+    assert templates.dependencies("value") == {"REF", "TWO"}
+    assert templates.refresh(["ONE"]) == set()
+
+    environ["TWO"] = "two"
+    assert templates.refresh(["TWO"]) == {"value"}
+    assert templates["value"] == "two"
+
+
+def test_template_set_unused_operands():
+    environ = {"HOST": "localhost"}
+    templates = expandvars.TemplateSet(
+        {"host": "${HOST:-$DEFAULT_HOST}"}, environ=environ
+    )
+
+    assert templates.dependencies("host") == {"HOST"}
+    assert templates.refresh(["DEFAULT_HOST"]) == set()
+
+    del environ["HOST"]
+    environ["DEFAULT_HOST"] = "example.com"
+    assert templates.refresh(["HOST"]) == {"host"}
+    assert templates["host"] == "example.com"
+    assert templates.dependencies("host") == {"HOST", "DEFAULT_HOST"}
+
+
+def test_template_set_assignments():
+    environ = {}
+    templates = expandvars.TemplateSet(
+        {"user": "user=$USER", "default": "${USER:=${DEFAULT_USER:-admin}}"},
+        environ=environ,
+    )
+
+    # The template added first is rendered again after the assignment.
+    assert templates["user"] == "user=admin"
+    assert templates["default"] == "admin"
+    assert environ == {"USER": "admin"}
+
+    # Assigning the same value again doesn't render anything else.
+    assert templates.add("other", "${USER:=admin}") == {"other"}
+
+    # USER is set now, so changes to DEFAULT_USER don't matter anymore.
+    environ["DEFAULT_USER"] = "root"
+    assert templates.refresh(["DEFAULT_USER"]) == set()
+
+    del environ["USER"]
+    assert templates.refresh(["USER"]) == {"user", "default", "other"}
+    assert templates["user"] == "user=root"
+    assert templates["other"] == "root"
+    assert environ["USER"] == "root"
+
+
+def test_template_set_errors():
+    environ = {}
+    templates = expandvars.TemplateSet(
+        {"host": "${HOST:?not set}", "port": "${PORT:-80}"}, environ=environ
+    )
+
+    assert list(templates.errors) == ["host"]
+    with pytest.raises(expandvars.ParameterNullOrNotSet) as e:
+        templates["host"]
+    assert e.value is templates.errors["host"]
+    assert templates["port"] == "80"
+
+    # Same error again.
+    assert templates.refresh() == set()
+
+    environ["HOST"] = "localhost"
+    assert templates.refresh(["HOST"]) == {"host"}
+    assert templates["host"] == "localhost"
+    assert templates.errors == {}
+
+    del environ["HOST"]
+    assert templates.refresh(["HOST"]) == {"host"}
+    assert "host" in templates.errors
+
+    with pytest.raises(expandvars.MissingClosingBrace):
+        templates.add("broken", "${HOST")
+    assert "broken" not in templates
+
+
+def test_template_set_options():
+    environ = {"FOO": "foo"}
+
+    templates = expandvars.TemplateSet(
+        {"a": "%FOO%{FOO}\\%FOO"},
+        environ=environ,
+        var_symbol="%",
+        surrounded_vars_only=True,
+        escape_char="",
+    )
+    assert templates["a"] == "%FOOfoo\\%FOO"
+
+    templates = expandvars.TemplateSet({"a": "$FOO$BAR"}, environ=environ, nounset=True)
+    assert isinstance(templates.errors["a"], expandvars.UnboundVariable)
+    assert templates.dependencies("a") == {"FOO", "BAR", "EXPANDVARS_RECOVER_NULL"}
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+
+import importlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import expandvars
+
+
+def test_expand_from_many_threads(monkeypatch):
+    importlib.reload(expandvars)
+    # Restores the cache of the default size afterwards.
+    monkeypatch.setattr(expandvars, "_compile_cached", expandvars._compile_cached)
+    expandvars.set_cache_maxsize(50)
+
+    texts = ["$A{0}:${{B:-{0}}}/${{C/x/{0}}}".format(i) for i in range(200)]
+    expected = [expandvars.expand(text, environ={"C": "x"}) for text in texts]
+    barrier = threading.Barrier(16)
+
+    def work(offset):
+        barrier.wait()
+        environ = expandvars.EnvironOverlay({"C": "x"})
+        for _ in range(5):
+            for i in range(len(texts)):
+                i = (i + offset) % len(texts)
+                assert expandvars.expand(texts[i], environ=environ) == expected[i]
+        return True
+
+    with ThreadPoolExecutor(16) as pool:
+        assert all(pool.map(work, range(0, 200, 13)))
+
+    info = expandvars.cache_info()
+    assert info.currsize <= info.maxsize == 50
+    assert info.hits + info.misses > 0
+
+
+def test_template_from_many_threads():
+    template = expandvars.compile("${NAME^^}:${ID:=$DEFAULT}:${#NAME}")
+
+    def work(i):
+        environ = expandvars.EnvironOverlay(
+            {"NAME": "n{0}".format(i), "DEFAULT": str(i)}
+        )
+        result = template.render(environ=environ)
+        return result, environ.assignments
+
+    with ThreadPoolExecutor(8) as pool:
+        results = list(pool.map(work, range(100)))
+
+    assert results == [
+        ("N{0}:{0}:{1}".format(i, len(str(i)) + 1), {"ID": str(i)}) for i in range(100)
+    ]
+
+
+def test_cache():
+    calls = []
+
+    @expandvars._cached(maxsize=2)
+    def square(n):
+        """Square n."""
+        calls.append(n)
+        return n * n
+
+    assert square.__doc__ == "Square n."
+    assert [square(n) for n in (1, 2, 1, 3, 2, 1)] == [1, 4, 1, 9, 4, 1]
+    # 1 was hit, so 2 was evicted first, then 1.
+    assert calls == [1, 2, 3, 2, 1]
+    assert square.cache_info() == (1, 5, 2, 2)
+
+    square.cache_clear()
+    assert square.cache_info() == (0, 0, 2, 0)
+
+
+def test_cache_added_concurrently():
+    calls = []
+
+    def compute(n):
+        if not calls:
+            # Another thread computes and adds the same entry in the meantime.
+            calls.append(n)
+            cache(n)
+        return n
+
+    cache = expandvars._Cache(compute, None)
+    assert cache(5) == 5
+    assert cache.cache_info() == (0, 2, None, 1)
+    assert cache(5) == 5